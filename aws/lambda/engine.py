@@ -0,0 +1,52 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+CONCURRENCY = int(os.environ.get('concurrency', 5))
+
+
+def run(tasks, concurrency: int = CONCURRENCY):
+    """
+    Executes the tasks keeping up to `concurrency` of them in flight at all times.
+
+    Each task is a callable without arguments (usually a functools.partial around a request). As soon as
+    one task finishes the next one is started, so a slow request only holds its own slot instead of
+    stalling a whole batch.
+
+    Parameters:
+        tasks (iterable): Callables to execute. May be a generator, it is consumed as slots free up.
+        concurrency (int): Maximum number of tasks running at the same time.
+
+    Returns:
+        list: The result of each task, in the same order as the tasks. Tasks that raised return None.
+
+    Example:
+        run([partial(request_and_save, fn, symbol) for symbol in symbols], concurrency=5)
+    """
+    start_time = time.time()
+    results = asyncio.run(_run(tasks, concurrency))
+    elapsed_time = time.time() - start_time
+    if results:
+        print(f'{len(results)} tasks completed in {elapsed_time:.2f} seconds '
+              f'({len(results) / max(elapsed_time, 1e-6):.2f} req/s).')
+    return results
+
+
+async def _run(tasks, concurrency: int):
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    futures = list()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for task in tasks:
+            await semaphore.acquire()
+            future = loop.run_in_executor(executor, task)
+            future.add_done_callback(lambda _: semaphore.release())
+            futures.append(future)
+        results = await asyncio.gather(*futures, return_exceptions=True)
+
+    for index, result in enumerate(results):
+        if isinstance(result, Exception):
+            print(f'Task error: {result}')
+            results[index] = None
+    return results
@@ -1,26 +1,256 @@
 import requests
+import io
 import json
-import boto3
 import time
 import os
-import awswrangler as wr
-from datetime import datetime, timedelta
+import threading
+import cleanup
+import query_cache
+import s3_writer
+import schema
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime
+from requests.adapters import HTTPAdapter
+from rate_limit import TokenBucket, retry_after_seconds
+from retry import RetryBudget, RetryPolicy
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class LazyClient:
+    """
+    boto3 client created on first use, so importing the module makes no AWS call and does not load boto3.
+
+    Keyword arguments are passed to botocore.config.Config (timeouts, retries).
+
+    Example:
+        s3 = LazyClient('s3')
+        s3.put_object(...)  # the client is created here, once, and reused
+    """
+    def __init__(self, service_name: str, **config):
+        self.service_name = service_name
+        self.config = config
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import boto3
+                    from botocore.config import Config
+                    self._client = boto3.client(self.service_name, config=Config(**self.config))
+        return getattr(self._client, name)
+
+
+s3 = LazyClient('s3')
+secrets_manager = LazyClient('secretsmanager')
+athena_client = LazyClient('athena')
+glue_client = LazyClient('glue')
+codebuild_client = LazyClient('codebuild')
+# Shards are synchronous invokes that last up to the function timeout (900 s): the read timeout must outlast
+# them, and a retry would run the same shard twice, so botocore does not retry.
+lambda_client = LazyClient('lambda', connect_timeout=float(os.environ.get('lambda_connect_timeout', 10)),
+                           read_timeout=float(os.environ.get('lambda_read_timeout', 910)),
+                           retries={'max_attempts': 0})
+
+POOL_SIZE = int(os.environ.get('pool_size', 5))
+TIMEOUT = (float(os.environ.get('connect_timeout', 3.05)), float(os.environ.get('read_timeout', 30)))
+
+_SESSION = None
+_API_KEY = None
+_SESSION_LOCK = threading.Lock()
+
+RATE_LIMIT = float(os.environ.get('rate_limit', 5))
+RATE_BURST = int(os.environ.get('rate_burst', 5))
+LIMITER = TokenBucket(rate=RATE_LIMIT, burst=RATE_BURST)
+RETRY = RetryPolicy(attempts=int(os.environ.get('retry_attempts', 4)))
+RETRY_BUDGET = RetryBudget(int(os.environ.get('retry_budget', 200)))
+RETRY_STATUS = (429, 500, 502, 503, 504)
+DEAD_LETTER_PREFIX = 'dead_letter/'
+RAW_FOLDERS = ('earning_calendar', 'profile', 'historical_price_full')
+PARTITION_COLUMNS = dict(earning_calendar='date', historical_price_full='search_date', profile=None)
+# Years covered by the partition projection of the raw tables; rows outside it could never be queried.
+YEAR_RANGE = (2000, 2050)
+RAW_FORMAT = os.environ.get('raw_format', 'json')
+# Glue storage of the raw tables for each RAW_FORMAT, so Athena reads the files the way they are written.
+RAW_STORAGE = dict(
+    json=dict(InputFormat='org.apache.hadoop.mapred.TextInputFormat',
+              OutputFormat='org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat',
+              SerdeInfo=dict(SerializationLibrary='org.openx.data.jsonserde.JsonSerDe',
+                             Parameters={'ignore.malformed.json': 'true'})),
+    parquet=dict(InputFormat='org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat',
+                 OutputFormat='org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat',
+                 SerdeInfo=dict(SerializationLibrary='org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe',
+                                Parameters={'serialization.format': '1'})),
+)
+PARQUET_COMPRESSION = os.environ.get('parquet_compression', 'snappy')
+ROW_GROUP_SIZE = int(os.environ.get('row_group_size', 100000))
+RAW_STAGING = os.environ.get('raw_staging', 'false').lower() == 'true'
+RUNS_PREFIX = 'runs/'
+RUN_PREFIX = ''
+RAW_OUTPUT_DIR = os.environ.get('raw_output_dir') or None
+ATHENA_POLL = (float(os.environ.get('athena_poll_initial', 0.1)), float(os.environ.get('athena_poll_max', 2)))
+ATHENA_STATS = defaultdict(int)
+QUERY_REUSE_MINUTES = int(os.environ.get('query_reuse_minutes', 60))
+
+
+def get_session(pool_size: int = POOL_SIZE):
+    """
+    Returns the HTTP session shared by every request of the process.
+
+    The session keeps the connections to the API alive between requests, so the TCP/TLS handshake
+    is paid once per pooled connection instead of once per request. It is created on first use and
+    reused by all threads.
+
+    Parameters:
+        pool_size (int): Maximum number of connections kept open, should match the worker concurrency.
+
+    Returns:
+        requests.Session: Pooled session.
+    """
+    global _SESSION
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _SESSION = session
+    return _SESSION
+
+
+def share_rate_limit(shards: int = 1):
+    """
+    Resets LIMITER to a 1/shards share of the API quota, so parallel workers stay within the quota together.
+
+    Parameters:
+        shards (int): Number of workers running at the same time.
 
-s3 = boto3.client('s3')
-secrets_manager = boto3.client('secretsmanager')
-athena_client = boto3.client('athena')
-glue_client = boto3.client('glue')
-codebuild_client = boto3.client('codebuild')
+    Returns:
+        None
+    """
+    global LIMITER
+    LIMITER = TokenBucket(rate=RATE_LIMIT / shards, burst=max(1, RATE_BURST // shards))
 
 
 def delete_json_files(bucket_name: str = os.environ.get('bucket_raw')):
-    objects = s3.list_objects_v2(Bucket=bucket_name)
-    for obj in objects.get('Contents', []):
-        if obj['Key'].endswith('.json'):
-            s3.delete_object(Bucket=bucket_name, Key=obj['Key'])
-            print(f"Arquivo {obj['Key']} excluído.")
+    """
+    Deletes the raw files of the previous run, with paginated listing and batched, parallel deletes.
+
+    Parameters:
+        bucket_name (str): Raw bucket.
+
+    Returns:
+        None
+    """
+    suffixes = ('.json', '.parquet', '.gz', '.zst')
+    deleted = 0
+    for table_name in RAW_FOLDERS:
+        deleted += cleanup.delete_keys(s3, bucket_name, cleanup.list_keys(s3, bucket_name, f'{table_name}/', suffixes))
+        query_cache.invalidate(table_name)
+    print(f"Delete objects: {deleted} arquivos excluídos.")
+
+
+def use_run(run_id: str = None):
+    """
+    Sets where the raw files of the run are written. With RAW_STAGING they go to a fresh runs/<run_id>/
+    prefix that the tables only read once promote_run switches them to it; otherwise to <table>/.
+
+    Parameters:
+        run_id (str): Id shared by every invocation and worker of the run.
+
+    Returns:
+        None
+    """
+    global RUN_PREFIX
+    RUN_PREFIX = f'{RUNS_PREFIX}{run_id}/' if RAW_STAGING and run_id else ''
+
+
+def use_output(directory: str = None):
+    """
+    Sets where the raw files are written: the raw bucket, or a local directory with the same
+    <table>/data_process=.../year=... layout (local backfills).
+
+    Parameters:
+        directory (str): Local directory, None for the raw bucket.
+
+    Returns:
+        None
+    """
+    global RAW_OUTPUT_DIR
+    RAW_OUTPUT_DIR = directory
+
+
+def promote_run(table_name: str, database: str = os.environ.get('data_base_name'),
+                bucket_name: str = os.environ.get('bucket_raw')):
+    """
+    Points a raw table at the staging prefix of the current run, then deletes the run it replaced.
+
+    The switch is a single Glue update_table, so queries see either the previous run or the new one,
+    never a half-written or empty table; a run that fails before promoting leaves the previous data
+    in place.
+
+    Parameters:
+        table_name (str): Raw table (one of RAW_FOLDERS).
+        database (str): Glue database of the raw tables.
+        bucket_name (str): Raw bucket.
+
+    Returns:
+        None
+    """
+    if not RUN_PREFIX:
+        return
+    try:
+        previous = glue_client.get_table(DatabaseName=database, Name=table_name)['Table']['StorageDescriptor']['Location']
+    except glue_client.exceptions.EntityNotFoundException:
+        previous = None
+    register_partition_projection(table_name, database, bucket_name, RUN_PREFIX)
+    query_cache.invalidate(table_name)
+    old_prefix = (previous or '').replace(f's3://{bucket_name}/', '', 1)
+    if old_prefix.startswith(RUNS_PREFIX) and old_prefix != f'{RUN_PREFIX}{table_name}/':
+        deleted = cleanup.delete_keys(s3, bucket_name, cleanup.list_keys(s3, bucket_name, old_prefix))
+        print(f'{table_name} promoted to {RUN_PREFIX}, {deleted} arquivos da execução anterior excluídos.')
+
+
+def load_dead_letters(get_api: str, bucket_name: str = os.environ.get('bucket_raw')):
+    """
+    Reads the keys that failed in previous runs for an API endpoint.
+
+    Parameters:
+        get_api (str): API endpoint name.
+        bucket_name (str): Bucket where the dead-letter files are kept.
+
+    Returns:
+        list: Keys (dicts) that must be requested again.
+    """
+    try:
+        response = s3.get_object(Bucket=bucket_name, Key=f'{DEAD_LETTER_PREFIX}{get_api}.json')
+        return json.loads(response['Body'].read())
+    except s3.exceptions.NoSuchKey:
+        return []
+
+
+def save_dead_letters(get_api: str, keys: list, bucket_name: str = os.environ.get('bucket_raw')):
+    """
+    Persists the keys that still failed after every retry so the next run requests them again.
+
+    Parameters:
+        get_api (str): API endpoint name.
+        keys (list): Failed keys (dicts). An empty list clears the dead-letter file.
+        bucket_name (str): Bucket where the dead-letter files are kept.
 
-    print("Delete objects")
+    Returns:
+        None
+    """
+    s3.put_object(Bucket=bucket_name, Key=f'{DEAD_LETTER_PREFIX}{get_api}.json', Body=json.dumps(keys))
+    if keys:
+        print(f'{len(keys)} {get_api} keys saved to dead letter.')
 
 
 def start_codebuild():
@@ -51,14 +281,86 @@ def crawler_start():
             print(f"Erro ao iniciar o Crawler: {e}")
 
 
+def register_partition_projection(table_name: str, database: str = os.environ.get('data_base_name'),
+                                  bucket_name: str = os.environ.get('bucket_raw'), prefix: str = '',
+                                  file_format: str = RAW_FORMAT):
+    """
+    Enables Athena partition projection on a raw table written by UploadS3.
+
+    With projection Athena computes the data_process/year partitions from the query predicates instead
+    of listing them in the catalog, so a query filtered on data_process only reads that day's files.
+    The SerDe and input/output formats are set from the raw format (RAW_STORAGE), and for Parquet the
+    columns from schema.RAW_SCHEMAS, so the crawler's JSON definition is switched along with the files.
+    It is called after the raw files of the previous run are deleted (or on a fresh staging prefix), so
+    the table never points at files of the other format.
+
+    Parameters:
+        table_name (str): Raw table (one of RAW_FOLDERS).
+        database (str): Glue database of the raw tables.
+        bucket_name (str): Raw bucket.
+        prefix (str): Prefix of the table folder, e.g. the runs/<run_id>/ staging prefix of a run.
+        file_format (str): 'json' or 'parquet', the format the raw files are written in.
+
+    Returns:
+        None
+    """
+    try:
+        table = glue_client.get_table(DatabaseName=database, Name=table_name)['Table']
+    except glue_client.exceptions.EntityNotFoundException:
+        print(f'A tabela {table_name} ainda não existe.')
+        return
+    location = f's3://{bucket_name}/{prefix}{table_name}/data_process=${{data_process}}'
+    partition_keys = [dict(Name='data_process', Type='string')]
+    parameters = {
+        'projection.enabled': 'true',
+        'projection.data_process.type': 'date',
+        'projection.data_process.format': 'yyyy-MM-dd',
+        'projection.data_process.range': '2020-01-01,NOW',
+        'projection.data_process.interval': '1',
+        'projection.data_process.interval.unit': 'DAYS',
+    }
+    if PARTITION_COLUMNS.get(table_name):
+        location += '/year=${year}'
+        partition_keys.append(dict(Name='year', Type='string'))
+        parameters.update({
+            'projection.year.type': 'integer',
+            'projection.year.range': f'{YEAR_RANGE[0]},{YEAR_RANGE[1]}',
+        })
+    parameters['storage.location.template'] = f'{location}/'
+    parameters['classification'] = file_format
+    storage = table['StorageDescriptor']
+    serde = storage.get('SerdeInfo', {}).get('SerializationLibrary')
+    if all(table.get('Parameters', {}).get(key) == value for key, value in parameters.items()) \
+            and serde == RAW_STORAGE[file_format]['SerdeInfo']['SerializationLibrary']:
+        return
+
+    partition_names = [key['Name'] for key in partition_keys]
+    storage['Columns'] = [column for column in storage['Columns'] if column['Name'] not in partition_names]
+    if file_format == 'parquet':
+        storage['Columns'] = [dict(Name=name, Type=kind) for name, kind in schema.RAW_SCHEMAS[table_name]]
+    storage.update(RAW_STORAGE[file_format])
+    storage['Location'] = f's3://{bucket_name}/{prefix}{table_name}/'
+    glue_client.update_table(DatabaseName=database, TableInput=dict(
+        Name=table['Name'],
+        TableType=table.get('TableType', 'EXTERNAL_TABLE'),
+        StorageDescriptor=storage,
+        PartitionKeys=partition_keys,
+        Parameters={**table.get('Parameters', {}), **parameters},
+    ))
+    print(f'Partition projection enabled on {table_name} ({file_format}).')
+
+
 def secret_key():
+    global _API_KEY
+    if _API_KEY is not None:
+        return _API_KEY
     try:
         response = secrets_manager.get_secret_value(
             SecretId=os.environ.get('secret_key')
         )
         secret_data = json.loads(response['SecretString'])
-        api_key = secret_data['api_key']
-        return api_key
+        _API_KEY = secret_data['api_key']
+        return _API_KEY
     except Exception as e:
         return None
 
@@ -75,33 +377,109 @@ def athena_query(query: str, database: str = os.environ.get('data_base_name')):
     Returns:
     - list: Lista de dicionários representando as linhas de resultados.
     """
+    import awswrangler as wr
+
     output_location: str = f"{os.environ.get('output_location')}lambda"
+    key = query_cache.cache_key(query, table_versions(query, database))
+    rows = query_cache.get(key)
+    if rows is not None:
+        print('Athena cache hit')
+        return rows
     try:
         df = wr.athena.read_sql_query(
             sql=query,
             database=database,
             s3_output=output_location,
+            athena_cache_settings={'max_cache_seconds': QUERY_REUSE_MINUTES * 60 if query_cache.reusable(query) else 0},
         )
-        rows = df.to_dict(orient='records')
-        return rows
+        rows = json.loads(df.to_json(orient='records', date_format='iso'))
     except Exception as e:
         print(f"A consulta falhou com o seguinte erro: {str(e)}")
         return []
+    query_cache.put(key, query, rows)
+    return rows
 
 
-def create_table(query: str, database: str = os.environ.get('data_base_name')):
+def table_versions(query: str, database: str = os.environ.get('data_base_name')):
     """
-    Executa uma consulta no AWS Athena.
+    Returns the Glue UpdateTime of every table read by a query, used as its version in the query cache.
 
-    Args:
-    - query (str): A consulta Athena a ser executada.
-    - database (str): O nome do banco de dados Athena.
-    - output_location (str): O local onde os resultados da consulta serão armazenados.
+    Parameters:
+        query (str): SQL text.
+        database (str): Database of the tables that are not qualified in the query.
 
     Returns:
-    - list: Lista de dicionários representando as linhas de resultados.
+        dict: 'database.table' -> UpdateTime (None when the table does not exist).
+    """
+    versions = dict()
+    for table_database, table_name in query_cache.tables(query):
+        table_database = table_database or database
+        try:
+            table = glue_client.get_table(DatabaseName=table_database, Name=table_name)['Table']
+            versions[f'{table_database}.{table_name}'] = table.get('UpdateTime')
+        except glue_client.exceptions.EntityNotFoundException:
+            versions[f'{table_database}.{table_name}'] = None
+    return versions
+
+
+def wait_query(query_execution_id: str, poll: tuple = ATHENA_POLL):
+    """
+    Waits for an Athena query to finish, polling quickly at first and backing off for long queries.
+
+    Parameters:
+        query_execution_id (str): Id returned by start_query_execution.
+        poll (tuple): Initial and maximum seconds between two get_query_execution calls.
+
+    Returns:
+        dict: Final QueryExecution, with the state and the statistics of the query.
+    """
+    delay, maximum = poll
+    while True:
+        query_execution = athena_client.get_query_execution(QueryExecutionId=query_execution_id)['QueryExecution']
+        if query_execution['Status']['State'] in ('SUCCEEDED', 'FAILED', 'CANCELLED'):
+            return query_execution
+        time.sleep(delay)
+        delay = min(maximum, delay * 2)
+
+
+def query_stats(query_execution: dict):
+    """
+    Extracts the execution statistics of a finished Athena query and adds them to ATHENA_STATS.
+
+    Parameters:
+        query_execution (dict): QueryExecution returned by wait_query.
+
+    Returns:
+        dict: Bytes scanned and engine, queue and total times in milliseconds.
+    """
+    statistics = query_execution.get('Statistics', {})
+    stats = dict(bytes_scanned=statistics.get('DataScannedInBytes', 0),
+                 engine_ms=statistics.get('EngineExecutionTimeInMillis', 0),
+                 queue_ms=statistics.get('QueryQueueTimeInMillis', 0),
+                 total_ms=statistics.get('TotalExecutionTimeInMillis', 0))
+    ATHENA_STATS['queries'] += 1
+    for name, value in stats.items():
+        ATHENA_STATS[name] += value
+    return stats
+
+
+def execute_query(query: str, database: str = os.environ.get('data_base_name')):
+    """
+    Runs a statement in AWS Athena and waits for it to finish.
+
+    Parameters:
+        query (str): Statement to run.
+        database (str): Athena database.
+
+    Returns:
+        dict: Final QueryExecution of the statement.
     """
     output_location: str = f"{os.environ.get('output_location')}lambda"
+    params = dict()
+    if QUERY_REUSE_MINUTES > 0 and query_cache.reusable(query):
+        params['ResultReuseConfiguration'] = {
+            'ResultReuseByAgeConfiguration': {'Enabled': True, 'MaxAgeInMinutes': QUERY_REUSE_MINUTES}
+        }
     response = athena_client.start_query_execution(
         QueryString=query,
         QueryExecutionContext={
@@ -109,69 +487,127 @@ def create_table(query: str, database: str = os.environ.get('data_base_name')):
         },
         ResultConfiguration={
             'OutputLocation': output_location
-        }
+        },
+        **params
     )
-    query_execution_id = response['QueryExecutionId']
-    while True:
-        query_execution = athena_client.get_query_execution(QueryExecutionId=query_execution_id)
-        status = query_execution['QueryExecution']['Status']['State']
-        if status in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
-            break
-        time.sleep(2)
+    query_execution = wait_query(response['QueryExecutionId'])
+    stats = query_stats(query_execution)
+    print(f"Athena {query_execution['Status']['State']}: {stats['bytes_scanned']} bytes scanned, "
+          f"{stats['engine_ms']} ms engine, {stats['total_ms']} ms total")
+    return query_execution
+
+
+def iter_results(query_execution_id: str):
+    """
+    Yields the rows of a finished Athena query, following every page of get_query_results.
+
+    Parameters:
+        query_execution_id (str): Id of a query that SUCCEEDED.
+
+    Returns:
+        generator: One dict per row, with the column labels as keys and the values as strings.
+    """
+    paginator = athena_client.get_paginator('get_query_results')
+    columns = None
+    for page in paginator.paginate(QueryExecutionId=query_execution_id):
+        rows = page['ResultSet']['Rows']
+        if columns is None:
+            columns = [col['Label'] for col in page['ResultSet']['ResultSetMetadata']['ColumnInfo']]
+            rows = rows[1:]
+        for result in rows:
+            row = [field.get('VarCharValue', '') for field in result['Data']]
+            yield dict(zip(columns, row))
+
+
+def create_table(query: str, database: str = os.environ.get('data_base_name')):
+    """
+    Executa uma consulta no AWS Athena.
+
+    Args:
+    - query (str): A consulta Athena a ser executada.
+    - database (str): O nome do banco de dados Athena.
+
+    Returns:
+    - list: Lista de dicionários representando as linhas de resultados (todas as páginas).
+      Resultados de SELECT vêm do cache local enquanto as tabelas lidas não mudarem (ver query_cache).
+    """
+    key = None
+    if query_cache.is_select(query):
+        key = query_cache.cache_key(query, table_versions(query, database))
+        rows = query_cache.get(key)
+        if rows is not None:
+            print('Athena cache hit')
+            return rows
+    query_execution = execute_query(query, database)
+    status = query_execution['Status']['State']
     if status != 'SUCCEEDED':
         print(f"A consulta falhou com o status: {status}")
         return []
-    results = athena_client.get_query_results(QueryExecutionId=query_execution_id)
-    rows = []
-    columns = [col['Label'] for col in results['ResultSet']['ResultSetMetadata']['ColumnInfo']]
+    rows = list(iter_results(query_execution['QueryExecutionId']))
+    if key is not None:
+        query_cache.put(key, query, rows)
+    return rows
 
-    for result in results['ResultSet']['Rows'][1:]:
-        row = [field.get('VarCharValue', '') for field in result['Data']]
-        rows.append(dict(zip(columns, row)))
 
-    return rows
+def last_earning_date():
+    """
+    Returns the most recent earnings date already loaded in the ref earning_calendar table.
+
+    Returns:
+        date: Start date of the next earning_calendar extraction.
+    """
+    result = create_table("""SELECT max(date) result FROM "ref_financial-data_dev".earning_calendar""")
+    return datetime.strptime(result[0]['result'], '%Y-%m-%d').date()
+
+
+@dataclass(frozen=True)
+class RequestSpec:
+    """
+    Immutable description of one request to the Financial Modeling Prep API.
+
+    Parameters:
+        get_api (str): API endpoint.
+        symbol (str): Stock symbol, or comma-separated symbols for profile.
+        start_date (date): Initial date for the API request.
+        end_date (date): Final date for the API request.
+    """
+    get_api: str = 'earning_calendar'
+    symbol: str = None
+    start_date: date = None
+    end_date: date = None
 
 
 class Financial:
     """
     Class to make requests to the Financial Modeling Prep API.
+
+    The client holds no per-request state: every call receives its own RequestSpec, so a single
+    instance can be shared by any number of workers.
     """
-    def __init__(self,
-                 start_date: datetime = datetime.strptime(create_table("""SELECT max(date) result FROM "ref_financial-data_dev".earning_calendar""")[0]['result'], '%Y-%m-%d').date(),
-                 symbol: str = None,
-                 get_api: str = 'earning_calendar', range_days: int = 2):
+    def __init__(self, api_key: str = None):
         """
         Initializes the Financial class.
 
         Parameters:
-            api_key (str): Financial Modeling Prep API key.
-            start_date (datetime): Initial date for the API request.
-            symbol (str): Stock symbol.
-            get_api (str): API endpoint.
-            range_days (int): Interval days for the API request.
+            api_key (str): Financial Modeling Prep API key. Read from Secrets Manager when omitted.
 
         Returns:
             None
         """
-        self.start_date = start_date
-        self.end_date: datetime = self.start_date + timedelta(days=range_days)
-        self.range_days = range_days
-        self.__symbol = symbol
-        self.get_api = get_api
-        self.__api_key = secret_key()
-
-    def _url_list(self, url: str):
+        self.__api_key = api_key or secret_key()
+
+    def _url_list(self, spec: RequestSpec):
         """
-        Returns the URL and parameters configuration for each API endpoint.
+        Returns the URL and parameters configuration of the request.
 
         Parameters:
-            url (str): API endpoint name.
+            spec (RequestSpec): Request to build.
 
         Returns:
             dict: URL and parameters configuration.
 
         Example:
-            _url_list('earning_calendar')
+            _url_list(RequestSpec('earning_calendar', start_date=date(2020, 1, 1), end_date=date(2020, 1, 3)))
             # {'url': 'XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX',
             #  'params': {'from': '2020-01-01', 'to': '2020-01-03', 'apikey': 'your_api_key'}}
         """
@@ -179,101 +615,283 @@ class Financial:
         urls = dict(
             earning_calendar=dict(url=f"{base}earning_calendar",
                                   params={
-                                      'from': str(self.start_date),
-                                      'to': str(self.end_date),
+                                      'from': str(spec.start_date),
+                                      'to': str(spec.end_date),
                                       'apikey': self.__api_key
                                   }),
 
-            historical_price_full=dict(url=f'{base}historical-price-full/{self.__symbol}',
+            historical_price_full=dict(url=f'{base}historical-price-full/{spec.symbol}',
                                        params={
-                                           'from': str(self.start_date),
-                                           'to': str(self.end_date),
+                                           'from': str(spec.start_date),
+                                           'to': str(spec.end_date),
                                            'apikey': self.__api_key
                                        }),
 
-            profile=dict(url=f'{base}profile/{self.__symbol}',
+            profile=dict(url=f'{base}profile/{spec.symbol}',
                          params={
                              'apikey': self.__api_key
                          })
         )
 
-        if url in urls:
-            return urls[url]
+        if spec.get_api in urls:
+            return urls[spec.get_api]
         else:
             return None
 
-    def response_api(self):
+    def response_api(self, spec: RequestSpec):
         """
         Make the API request and return the result in JSON format.
 
+        Connection errors, timeouts, 429 and 5xx responses are retried with exponential backoff and
+        jitter while the run's retry budget allows it.
+
+        Parameters:
+            spec (RequestSpec): Request to make.
+
         Returns:
-            dict: Result of the API request in JSON format.
+            dict: Result of the API request in JSON format, or None if the request failed.
 
         Example:
-            response_api()
+            response_api(RequestSpec('earning_calendar', start_date=date(2020, 1, 1), end_date=date(2020, 1, 3)))
             # {'result': [{'symbol': 'AAPL', 'date': '2020-01-01', 'actualEPS': 0.0, 'consensusEPS': 0.0,
             # 'estimatedEPS': 0.0, 'numberOfEstimates': 0, 'EPSSurpriseDollar': 0.0, 'EPSReportDate': None,
             # 'fiscalPeriod': None, 'fiscalEndDate': None, 'yearAgoEPS': None, 'numberOfAnalysts': 0,
             # 'EPSTTM': 0.0, 'EPSTTMIDY': 0.0, 'revenue': 0.0, 'revenuePerShare': 0.0, ...
         """
-        url = self._url_list(self.get_api)
+        url = self._url_list(spec)
         if not url:
             print('get_api name not found')
             return None
 
-        try:
-            response = requests.get(url['url'], params=url['params'])
-            response.raise_for_status()
-            return response.json()
-
-        except requests.exceptions.HTTPError as errh:
-            print("HTTP Error:", errh)
-        except requests.exceptions.ConnectionError as errc:
-            print("Error Connecting:", errc)
-        except requests.exceptions.Timeout as errt:
-            print("Timeout Error:", errt)
-        except requests.exceptions.RequestException as err:
-            print("Oops! Something went wrong:", err)
+        for attempt in range(RETRY.attempts):
+            try:
+                LIMITER.acquire()
+                response = get_session().get(url['url'], params=url['params'], timeout=TIMEOUT)
+                if response.status_code == 429:
+                    LIMITER.throttle(retry_after_seconds(response.headers.get('Retry-After')))
+                response.raise_for_status()
+                LIMITER.success()
+                return response.json()
+
+            except requests.exceptions.HTTPError as errh:
+                print("HTTP Error:", errh)
+                if errh.response is None or errh.response.status_code not in RETRY_STATUS:
+                    return None
+            except requests.exceptions.ConnectionError as errc:
+                print("Error Connecting:", errc)
+            except requests.exceptions.Timeout as errt:
+                print("Timeout Error:", errt)
+            except requests.exceptions.RequestException as err:
+                print("Oops! Something went wrong:", err)
+                return None
+            if attempt + 1 == RETRY.attempts or not RETRY_BUDGET.spend():
+                break
+            time.sleep(RETRY.backoff(attempt))
         return None
 
 
+def _dumps(row: dict):
+    if orjson is not None:
+        try:
+            return orjson.dumps(row)
+        except TypeError:
+            pass
+    return json.dumps(row).encode()
+
+
+def to_ndjson(rows):
+    """
+    Serializes the rows as newline-delimited JSON in linear time.
+
+    Uses orjson when it is installed and falls back to the standard json module. DataFrames (see
+    flatten_historical) are serialized by pandas directly; their bigint columns (schema.RAW_SCHEMAS) are
+    written as integers, pandas having turned them to float when a bar lacks the field.
+
+    Parameters:
+        rows (iterable or DataFrame): Dicts to serialize.
+
+    Returns:
+        bytes: One JSON document per line.
+    """
+    if hasattr(rows, 'to_json'):
+        if rows.empty:
+            return b''
+        rows = _integer_columns(rows)
+        return rows.to_json(orient='records', lines=True, double_precision=15).rstrip('\n').encode() + b'\n'
+    buffer = io.BytesIO()
+    for row in rows:
+        buffer.write(_dumps(row))
+        buffer.write(b'\n')
+    return buffer.getvalue()
+
+
+def _integer_columns(frame):
+    """
+    Returns the frame with its float bigint columns as nullable Int64, so 10 is not written as 10.0.
+    """
+    import pandas as pd
+
+    bigint = {name for columns in schema.RAW_SCHEMAS.values() for name, kind in columns if kind == 'bigint'}
+    floats = [column for column in frame.columns
+              if column.lower() in bigint and pd.api.types.is_float_dtype(frame[column])]
+    if not floats:
+        return frame
+    return frame.assign(**{column: frame[column].round().astype('Int64') for column in floats})
+
+
+def to_arrow(get_api: str, rows):
+    """
+    Converts the rows to an Arrow table with the fixed schema of the endpoint (see schema.RAW_SCHEMAS).
+
+    Parameters:
+        get_api (str): API endpoint name.
+        rows (iterable or DataFrame): Dicts to convert.
+
+    Returns:
+        pyarrow.Table: Table with the declared columns and types.
+    """
+    import pyarrow as pa
+
+    types = dict(string=pa.string(), double=pa.float64(), bigint=pa.int64(), boolean=pa.bool_())
+    data = schema.columns(get_api, rows)
+    return pa.table({name: pa.array(data[name], type=types[kind], from_pandas=True)
+                     for name, kind in schema.RAW_SCHEMAS[get_api]})
+
+
+def to_parquet(get_api: str, rows, compression: str = PARQUET_COMPRESSION, row_group_size: int = ROW_GROUP_SIZE):
+    """
+    Serializes the rows as a Parquet file with the fixed schema of the endpoint.
+
+    Parameters:
+        get_api (str): API endpoint name.
+        rows (iterable or DataFrame): Dicts to serialize.
+        compression (str): Parquet codec, e.g. 'snappy' or 'zstd'.
+        row_group_size (int): Maximum number of rows per row group.
+
+    Returns:
+        bytes: Parquet file.
+    """
+    import pyarrow.parquet as pq
+
+    buffer = io.BytesIO()
+    pq.write_table(to_arrow(get_api, rows), buffer, compression=compression, row_group_size=row_group_size)
+    return buffer.getvalue()
+
+
+def raw_writer(bucket_name: str = os.environ.get('bucket_raw'), file_format: str = RAW_FORMAT):
+    """
+    Returns the writer that packs the raw files of a run into large compressed objects.
+
+    Parameters:
+        bucket_name (str): Raw bucket.
+        file_format (str): 'json' or 'parquet'.
+
+    Returns:
+        s3_writer.RollingWriter: Writer to pass to UploadS3; must be closed at the end.
+    """
+    return s3_writer.RollingWriter(s3, bucket_name, file_format, root=RAW_OUTPUT_DIR)
+
+
+def flatten_historical(responses: list, data_process: str = None):
+    """
+    Flattens historical_price_full responses into a single table.
+
+    The bars of every response are loaded in one pass and their fields prefixed with 'historical_';
+    'search_date' and 'symbol' are broadcast from each response to its own bars only, and
+    'data_process', when given, to every row.
+
+    Parameters:
+        responses (list): Responses with the keys 'symbol', 'search_date' and 'historical'.
+        data_process (str): Processing date column. Omitted when None (UploadS3 writes it as a partition).
+
+    Returns:
+        DataFrame: One row per bar.
+    """
+    import numpy as np
+    import pandas as pd
+
+    lengths = [len(response.get('historical', [])) for response in responses]
+    frame = pd.DataFrame.from_records([bar for response in responses for bar in response.get('historical', [])])
+    frame.columns = [f'historical_{column}' for column in frame.columns]
+    frame.insert(0, 'search_date', np.repeat([response.get('search_date') for response in responses], lengths))
+    frame.insert(1, 'symbol', np.repeat([response.get('symbol') for response in responses], lengths))
+    if data_process is not None:
+        frame['data_process'] = data_process
+    return frame
+
+
+def _year(value):
+    """
+    Returns:
+        str: Year partition of an event date, None when the date is missing or outside YEAR_RANGE.
+    """
+    year = str(value or '')[:4]
+    if year.isdigit() and YEAR_RANGE[0] <= int(year) <= YEAR_RANGE[1]:
+        return year
+    return None
+
+
 class UploadS3:
     """
     Class to save files in their respective folders
+
+    Files are written in Hive-style partitions, by processing date and year of the event date:
+    <folder>/data_process=YYYY-MM-DD/year=YYYY/<name>.<format>[.gz] (profile has no year partition).
+    When a RollingWriter is given, consecutive saves are appended to the same large objects.
     """
     def __init__(self, file: list, folder_save: str = 'earning_calendar',
-                 bucket: str = os.environ.get('bucket_raw')
+                 bucket: str = os.environ.get('bucket_raw'),
+                 file_format: str = RAW_FORMAT,
+                 writer: s3_writer.RollingWriter = None
                  ):
         self.folder_save = folder_save
         self.bucket = bucket
         self.file = file
+        self.file_format = file_format
+        self.writer = writer
+        self.data_process = str(datetime.now().date())
+
+    def _rows(self):
+        if self.folder_save == 'historical_price_full':
+            return flatten_historical(self.file)
+        return self.file
+
+    def _partitions(self):
+        rows = self._rows()
+        prefix = f'{RUN_PREFIX}{self.folder_save}/data_process={self.data_process}'
+        column = PARTITION_COLUMNS.get(self.folder_save)
+        if column is None:
+            return [(prefix, rows)]
+        if hasattr(rows, 'groupby'):
+            keys = rows[column].map(_year)
+            self._log_dropped(int(keys.isna().sum()), column)
+            return [(f'{prefix}/year={year}', group) for year, group in rows.groupby(keys)]
+        years = defaultdict(list)
+        dropped = 0
+        for row in rows:
+            year = _year(row.get(column))
+            if year is None:
+                dropped += 1
+                continue
+            years[year].append(row)
+        self._log_dropped(dropped, column)
+        return [(f'{prefix}/year={year}', group) for year, group in years.items()]
+
+    def _log_dropped(self, dropped: int, column: str):
+        if dropped:
+            print(f'{dropped} {self.folder_save} rows without a {column} in {YEAR_RANGE[0]}-{YEAR_RANGE[1]} '
+                  f'dropped: no year partition can hold them')
 
     def save_s3(self):
-        bucket_name = self.bucket
-        name = (str(datetime.now())
-                .replace(' ', '')
-                .replace(':', '')
-                .replace('.', '')
-                .replace('-', ''))
-
-        envio = str()
-        new = dict(data_process=str(datetime.now().date()))
         if len(self.file) == 0:
             return
-        if self.folder_save != 'historical_price_full':
-            for dados in self.file:
-                envio = envio + '{}\n'.format(json.dumps(dados))
-        else:
-            for dados in self.file:
-                for e in dados:
-                    if type(dados[e]) != list:
-                        new[e] = dados[e]
-                    else:
-                        for i in dados[e]:
-                            for x in i:
-                                new[f'{e}_{x}'] = i[x]
-                            envio = envio + '{}\n'.format(json.dumps(new))
-
-        s3_file_path = f'{self.folder_save}/{name}.json'
-        s3.put_object(Bucket=bucket_name, Key=s3_file_path, Body=envio)
+        writer = self.writer or s3_writer.RollingWriter(s3, self.bucket, self.file_format, root=RAW_OUTPUT_DIR)
+        for prefix, rows in self._partitions():
+            if self.file_format == 'parquet':
+                envio = s3_writer.ParquetPart(to_arrow(self.folder_save, rows), PARQUET_COMPRESSION, ROW_GROUP_SIZE)
+            else:
+                envio = to_ndjson(rows)
+            writer.write(prefix, envio)
+        if self.writer is None:
+            writer.close()
 
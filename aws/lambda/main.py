@@ -1,92 +1,164 @@
+import os
 import time
-import threading
+import engine
 import financial
+import manifest
+import pipeline
+import planner
+import scheduler
+import sharding
+from dataclasses import replace
 from datetime import datetime, timedelta
+from functools import partial
+from itertools import chain
 
-EARNINGS_DATA = list()
-THREADS = list()
+DEAD_LETTERS = list()
+PROFILE_BATCH_SIZE = int(os.environ.get('profile_batch_size', 50))
+STAGES = ('etl', 'profile', 'historical_price_full')
+STAGE_TABLES = dict(etl='earning_calendar', profile='profile', historical_price_full='historical_price_full')
+RUN_ID = None
+DEADLINE = scheduler.Deadline()
 
 
-def request_and_save(start_time: time.time(), fn: financial, symbol: str = None, date=None):
+def request_and_save(fn: financial.Financial, spec: financial.RequestSpec, sink: pipeline.Pipeline,
+                     window: dict = None, density: planner.DensityWindows = None):
     """
     Function created to make parallelized API requests
-    :param start_time: The start time of the request.
-    :param fn: The financial object to use for the request.
-    :param symbol: The symbol to use for the request.
-    :param date: The date to use for the request.
-    :return: True if the request was successful, False otherwise.
-    """
-    global THREADS, EARNINGS_DATA
-    if fn.get_api == 'earning_calendar':
-        tmp = fn.response_api()
+    :param fn: The financial client to use for the request.
+    :param spec: The request to make. For profile, spec.symbol is a comma-separated list of symbols.
+    :param sink: The pipeline that receives the results.
+    :param window: The merged historical_price_full window (see planner.coalesce_windows) of the request.
+    :param density: The earning_calendar window planner, told the row count of each response.
+    :return: True if the request returned data, False if it returned nothing and None if it failed.
+        Failed keys (error, unexpected payload or any exception while saving), and keys skipped because
+        the time budget of the invocation is spent, are kept in DEAD_LETTERS.
+    """
+    try:
+        return _request_and_save(fn, spec, sink, window, density)
+    except Exception as e:
+        print(f'Request error {spec.get_api} {spec.symbol or ""} {spec.start_date or ""}: {e}')
+        DEAD_LETTERS.extend(dead_letter_keys(spec, window))
+        return None
+
+
+def valid_payload(get_api: str, payload):
+    """
+    FMP answers some errors with HTTP 200 and {'Error Message': ...}: only a payload of the expected shape
+    (a list of rows, or the historical_price_full dict) counts as a response.
+    """
+    if isinstance(payload, dict) and 'Error Message' in payload:
+        return False
+    if get_api == 'historical_price_full':
+        return isinstance(payload, dict) or payload == []
+    return isinstance(payload, list) and all(isinstance(row, dict) for row in payload)
+
+
+def _request_and_save(fn: financial.Financial, spec: financial.RequestSpec, sink: pipeline.Pipeline,
+                      window: dict = None, density: planner.DensityWindows = None):
+    if DEADLINE.expired():
+        DEADLINE.skip()
+        DEAD_LETTERS.extend(dead_letter_keys(spec, window))
+        return None
+    start_time = time.time()
+    if spec.get_api == 'earning_calendar':
+        tmp = fn.response_api(spec)
         end_time = time.time()
         elapsed_time = end_time - start_time
-        print(f'API request {fn.end_date} completed in {elapsed_time:.2f} seconds.')
+        print(f'API request {spec.end_date} completed in {elapsed_time:.2f} seconds.')
+        if tmp is None or not valid_payload(spec.get_api, tmp):
+            print(f'API error: {str(tmp)[:200]}')
+            DEAD_LETTERS.extend(dead_letter_keys(spec, window))
+            return None
+        if len(tmp) >= planner.ROW_CAP and spec.end_date > spec.start_date:
+            print(f'{len(tmp)} rows reached the API cap, splitting {spec.start_date} to {spec.end_date}')
+            status = [request_and_save(fn, replace(spec, start_date=start_date, end_date=end_date), sink,
+                                       window, density)
+                      for start_date, end_date in planner.bisect(spec.start_date, spec.end_date)]
+            return None if None in status else any(status)
+        if len(tmp) >= planner.ROW_CAP:
+            print(f'{len(tmp)} rows on {spec.start_date} reached the API cap, the day may be incomplete')
+        if density is not None:
+            density.observe(spec.start_date, spec.end_date, len(tmp))
         if not tmp:
-            print('API error')
             return False
         for index in tmp:
-            EARNINGS_DATA.append(index)
-        fn.start_date += timedelta(days=fn.range_days)
-        fn.end_date += timedelta(days=fn.range_days)
+            sink.put(index)
         return True
-    elif fn.get_api == 'profile':
-        tmp = fn.response_api()
+    elif spec.get_api == 'profile':
+        tmp = fn.response_api(spec)
         end_time = time.time()
         elapsed_time = end_time - start_time
-        print(f'API request {symbol} completed in {elapsed_time:.2f} seconds.')
-        if len(tmp) > 0:
-            EARNINGS_DATA.append(tmp[0])
-            return True
-        else:
-            return False
-    elif fn.get_api == 'historical_price_full':
-        fn.start_date = datetime.strptime(date, '%Y-%m-%d').date() - timedelta(days=10)
-        fn.end_date = datetime.strptime(date, '%Y-%m-%d').date() + timedelta(days=30)
-        tmp = fn.response_api()
+        print(f'API request {spec.symbol} completed in {elapsed_time:.2f} seconds.')
+        if tmp is None or not valid_payload(spec.get_api, tmp):
+            print(f'API error: {str(tmp)[:200]}')
+            DEAD_LETTERS.extend(dead_letter_keys(spec, window))
+            return None
+        requested = set(spec.symbol.split(','))
+        profiles = dict()
+        for index in tmp:
+            if index.get('symbol') in requested and index['symbol'] not in profiles:
+                profiles[index['symbol']] = index
+        for index in profiles.values():
+            sink.put(index)
+        return len(profiles) > 0
+    elif spec.get_api == 'historical_price_full':
+        tmp = fn.response_api(spec)
 
         end_time = time.time()
         elapsed_time = end_time - start_time
-        print(f'API request for {symbol} - {date} completed in {elapsed_time:.2f} seconds.')
-        if len(tmp):
-            EARNINGS_DATA.append(tmp)
-            return True
-        else:
-            return False
+        print(f'API request for {spec.symbol} - {spec.start_date} to {spec.end_date} '
+              f'({len(window["dates"])} dates) completed in {elapsed_time:.2f} seconds.')
+        if tmp is None or not valid_payload(spec.get_api, tmp):
+            print(f'API error: {str(tmp)[:200]}')
+            DEAD_LETTERS.extend(dead_letter_keys(spec, window))
+            return None
+        responses = planner.split_window(window, tmp) if tmp else []
+        for index in responses:
+            sink.put(index, size=len(index['historical']))
+        return len(responses) > 0
+
+
+def dead_letter_keys(spec: financial.RequestSpec, window: dict = None):
+    """
+    Returns the dead-letter keys of a request, in the format each extraction reads them back.
+    """
+    if spec.get_api == 'earning_calendar':
+        return [{'from': str(spec.start_date), 'to': str(spec.end_date)}]
+    if spec.get_api == 'profile':
+        return [{'symbol': symb} for symb in spec.symbol.split(',')]
+    return [{'symbol': spec.symbol, 'date': date} for date in window['dates']]
 
 
-def etl():
+def etl(resume: bool = False, start_date=None, end_date=None):
     """
-    Initiates the earnings calendar extraction process from the API, always between two days.
+    Initiates the earnings calendar extraction process from the API, from the last loaded date until two
+    days ago. The range is cut into windows sized on the observed earnings density (see
+    planner.DensityWindows) and windows truncated by the API are split in two until complete.
+
+    :param resume: Continuation of an interrupted run: only the windows kept in the dead letters are requested.
+    :param start_date: First day to extract (backfill), the last loaded date by default.
+    :param end_date: Last day to extract (backfill), two days ago by default.
     """
-    global THREADS, EARNINGS_DATA
+    global DEAD_LETTERS
     fn = financial.Financial()
+    get_api = 'earning_calendar'
     current_date = datetime.now()
-    count = 0
-    start_time_local = time.time()
-
-    while fn.end_date <= current_date.date() and fn.end_date + timedelta(days=1) < current_date.date():
-        thread = threading.Thread(target=request_and_save, args=(time.time(), fn))
-        THREADS.append(thread)
-        thread.start()
-        count += 1
-        if len(THREADS) >= 5 and start_time_local - time.time() < 1:
-            print('Delay...')
-            for t in THREADS:
-                t.join()
-            THREADS = list()
-            start_time_local = time.time()
-        if count == 15:
-            financial.UploadS3(file=EARNINGS_DATA, folder_save=fn.get_api).save_s3()
-            current_date = datetime.now()
-            EARNINGS_DATA = list()
-            count = 0
-    for t in THREADS:
-        t.join()
-    if len(EARNINGS_DATA) > 0:
-        print(EARNINGS_DATA)
-        financial.UploadS3(file=EARNINGS_DATA, folder_save=fn.get_api).save_s3()
-        EARNINGS_DATA = list()
+    specs = list()
+    for key in financial.load_dead_letters(get_api):
+        specs.append(financial.RequestSpec(get_api,
+                                           start_date=datetime.strptime(key['from'], '%Y-%m-%d').date(),
+                                           end_date=datetime.strptime(key['to'], '%Y-%m-%d').date()))
+    density = None
+    windows = iter(())
+    if not resume:
+        density = planner.DensityWindows(start_date or financial.last_earning_date(),
+                                         end_date or current_date.date() - timedelta(days=2))
+        windows = (financial.RequestSpec(get_api, start_date=start, end_date=end) for start, end in density)
+
+    with pipeline.Pipeline(get_api) as sink:
+        engine.run(partial(request_and_save, fn, spec, sink, density=density) for spec in chain(specs, windows))
+    financial.save_dead_letters(get_api, DEAD_LETTERS)
+    DEAD_LETTERS = list()
     print(f'-----save etl {current_date.date()} finish------')
 
 
@@ -94,54 +166,27 @@ def profile():
     """
     Initiates the company profile extraction process from the API, using the company 'symbol' for search.
     """
-    global THREADS, EARNINGS_DATA
-    create = """
-        CREATE EXTERNAL TABLE IF NOT EXISTS process_profile(
-          symbol string)
-        LOCATION 's3://financial-data-dev-financial-s3-bucket-raw/process_profile/'
-    """
-    financial.create_table(create)
-    query = """
-    select distinct a.symbol 
-    from "raw_financial-data_dev".earning_calendar a 
-    left join "ref_financial-data_dev".profile b on a.symbol = b.symbol
-    left join "raw_financial-data_dev".process_profile c on a.symbol = c.symbol
-    where b.symbol is null
-    and c.symbol is null
-    order by a.symbol
-    """
-
-    start_time_local = time.time()
-    symb = None
-    result = financial.athena_query(query)
-    add = list()
+    global DEAD_LETTERS
+    manifest.ensure_table('process_profile')
+    manifest.seed('process_profile', """SELECT DISTINCT symbol FROM "ref_financial-data_dev".profile""")
+    query = f"""
+    select distinct symbol
+    from "raw_financial-data_dev".earning_calendar
+    where data_process = '{datetime.now().date()}'
+    order by symbol
+    """
+
+    rows = financial.athena_query(query)
+    done = manifest.load_keys('process_profile', [(i['symbol'],) for i in rows])
+    result = [i for i in rows if (i['symbol'],) not in done]
+    get_api = 'profile'
+    result += [key for key in financial.load_dead_letters(get_api) if key not in result]
     if len(result) == 0:
         print('Finish')
-    fn = financial.Financial(get_api='profile')
-    for i in result:
-        for symb in i.values():
-            add.append(symb)
-            fn.symbol = symb
-            thread = threading.Thread(target=request_and_save, args=(time.time(), fn, symb))
-            THREADS.append(thread)
-            thread.start()
-
-            if len(THREADS) >= 5 and start_time_local - time.time() < 1:
-                print('Delay...')
-                for t in THREADS:
-                    t.join()
-                THREADS = list()
-                start_time_local = time.time()
-
-    print(EARNINGS_DATA)
-    if len(EARNINGS_DATA) > 0:
-        financial.UploadS3(file=EARNINGS_DATA, folder_save=fn.get_api).save_s3()
-        print(f'---profile {symb} finish---')
-        EARNINGS_DATA = list()
-    consulta_insert_multipla = """INSERT INTO process_profile (symbol) VALUES """
-    consulta_insert_multipla += ", ".join([f"('{valor}')" for valor in add])
-
-    financial.create_table(consulta_insert_multipla)
+    add = extract(get_api, result)
+    financial.save_dead_letters(get_api, DEAD_LETTERS)
+    DEAD_LETTERS = list()
+    manifest.append('process_profile', add)
     print(f'---profile finish---')
 
 
@@ -150,74 +195,185 @@ def historical_price_full(asc: bool = True):
     Initiates the extraction process of the full list of historical dividend payments for publicly traded companies,
     searching within the window of -10 to +30 days from the current date.
     """
-    global THREADS, EARNINGS_DATA
-    start_time_local = time.time()
-    create = """
-        CREATE EXTERNAL TABLE IF NOT EXISTS process_historical_price_full(
-          symbol string,
-          date string)
-        LOCATION 's3://financial-data-dev-financial-s3-bucket-raw/process_historical_price_full/'
-    """
-    financial.create_table(create)
-    query = """
-    select distinct 
-    a.symbol, 
-    a.date
-    from "raw_financial-data_dev".earning_calendar a 
-    left join "ref_financial-data_dev".historical_price_full b 
-    on a.symbol = b.symbol and a.date = b.search_date
-    left join "raw_financial-data_dev".process_historical_price_full c 
-    on a.symbol = c.symbol and a.date = c.date
-    where b.search_date is null
-    and b.symbol is null
-    and c.date is null
-    and c.symbol is null
-    order by a.symbol
-    """
-    result = financial.athena_query(query)
+    global DEAD_LETTERS
+    manifest.ensure_table('process_historical_price_full')
+    manifest.seed('process_historical_price_full',
+                  """SELECT DISTINCT symbol, search_date date FROM "ref_financial-data_dev".historical_price_full""")
+    query = f"""
+    select distinct
+    symbol,
+    date
+    from "raw_financial-data_dev".earning_calendar
+    where data_process = '{datetime.now().date()}'
+    order by symbol
+    """
+    rows = financial.athena_query(query)
+    done = manifest.load_keys('process_historical_price_full', [(i['symbol'], i['date']) for i in rows])
+    result = [i for i in rows if (i['symbol'], i['date']) not in done]
+    get_api = 'historical_price_full'
+    result += [key for key in financial.load_dead_letters(get_api) if key not in result]
     if len(result) == 0:
         print('Finish')
-    fn = financial.Financial(get_api='historical_price_full')
-    add = list()
-    push = 0
-    for i in result:
-        add.append([i['symbol'], i['date']])
-        fn.symbol = i['symbol']
-        thread = threading.Thread(target=request_and_save, args=(time.time(), fn, i['symbol'], i['date']))
-        THREADS.append(thread)
-        thread.start()
-        push+=1
-        if len(THREADS) >= 5 and start_time_local - time.time() < 1:
-            print(f'Delay... len list {len(EARNINGS_DATA)}')
-            for t in THREADS:
-                t.join()
-            THREADS = list()
-            start_time_local = time.time()
-        if push > 500 and len(EARNINGS_DATA) == 0:
-
-            consulta_insert_multipla = """INSERT INTO process_historical_price_full (symbol, date) VALUES """
-            consulta_insert_multipla += ", ".join([f"('{valor[0]}', '{valor[1]}')" for valor in add])
-            financial.create_table(consulta_insert_multipla)
-            push = 0
-            add = list()
-            print('insert results...')
-
-    for t in THREADS:
-        t.join()
-    print(EARNINGS_DATA)
-    if len(EARNINGS_DATA) > 0:
-        financial.UploadS3(file=EARNINGS_DATA, folder_save=fn.get_api).save_s3()
-        EARNINGS_DATA = list()
-    consulta_insert_multipla = """INSERT INTO process_historical_price_full (symbol, date) VALUES """
-    consulta_insert_multipla += ", ".join([f"('{valor[0]}', '{valor[1]}')" for valor in add])
-
-    financial.create_table(consulta_insert_multipla)
+    add = extract(get_api, result)
+    financial.save_dead_letters(get_api, DEAD_LETTERS)
+    DEAD_LETTERS = list()
+    manifest.append('process_historical_price_full', add)
     print(f'---historical_price_full finish---')
 
+
+def fetch_profile(keys: list):
+    """
+    Requests the profiles of the pending keys in batches of PROFILE_BATCH_SIZE symbols.
+
+    :param keys: Pending keys, dicts with 'symbol'.
+    :return: The processed keys, as manifest rows [symbol].
+    """
+    fn = financial.Financial()
+    get_api = 'profile'
+    symbols = [i['symbol'] for i in keys]
+    batches = [symbols[index:index + PROFILE_BATCH_SIZE] for index in range(0, len(symbols), PROFILE_BATCH_SIZE)]
+    with pipeline.Pipeline(get_api) as sink:
+        status = engine.run(partial(request_and_save, fn, financial.RequestSpec(get_api, symbol=','.join(batch)), sink)
+                            for batch in batches)
+    return [[symb] for batch, ok in zip(batches, status) if ok is not None for symb in batch]
+
+
+def fetch_historical_price_full(keys: list):
+    """
+    Requests the -10/+30 day windows of the pending keys, merged per symbol by the planner.
+
+    :param keys: Pending keys, dicts with 'symbol' and 'date'.
+    :return: The processed keys, as manifest rows [symbol, date].
+    """
+    fn = financial.Financial()
+    get_api = 'historical_price_full'
+    windows = planner.coalesce_windows([(i['symbol'], i['date']) for i in keys])
+    print(f'{len(keys)} keys merged into {len(windows)} requests')
+    with pipeline.Pipeline(get_api) as sink:
+        status = engine.run(partial(request_and_save, fn,
+                                    financial.RequestSpec(get_api, symbol=window['symbol'],
+                                                          start_date=window['from'], end_date=window['to']),
+                                    sink, window)
+                            for window in windows)
+    return [[window['symbol'], date] for window, ok in zip(windows, status) if ok is not None
+            for date in window['dates']]
+
+
+FETCHERS = dict(profile=fetch_profile, historical_price_full=fetch_historical_price_full)
+
+
+def extract(get_api: str, keys: list, shards: int = None):
+    """
+    Fetches the pending keys, fanned out to parallel workers when sharding is enabled.
+
+    The keys are partitioned by symbol hash and each shard runs in its own worker (a Lambda invocation,
+    or a process locally) with a 1/N share of the API rate limit. The coordinator merges the processed
+    keys and the dead letters of every worker; the keys of a worker that failed go to the dead letters.
+
+    :param get_api: 'profile' or 'historical_price_full'.
+    :param keys: Pending keys.
+    :param shards: Number of workers, sharding.SHARDS by default. 1 fetches in this invocation.
+    :return: The processed keys, as manifest rows.
+    """
+    shards = shards or sharding.SHARDS
+    if shards <= 1 or len(keys) < 2:
+        return FETCHERS[get_api](keys)
+    parts = sharding.partition(keys, shards)
+    remaining = DEADLINE.remaining()
+    expires_at = time.time() + remaining - DEADLINE.reserve_seconds if remaining != float('inf') else None
+    events = [dict(worker=get_api, shard=index, shards=len(parts), keys=part, expires_at=expires_at, run_id=RUN_ID)
+              for index, part in enumerate(parts)]
+    print(f'{len(keys)} {get_api} keys sent to {len(parts)} shards')
+    add = list()
+    for event, result in zip(events, sharding.dispatch(events, DEADLINE.context, run_shard)):
+        if result is None:
+            DEAD_LETTERS.extend(event['keys'])
+            continue
+        add.extend(result['done'])
+        DEAD_LETTERS.extend(result['dead_letters'])
+        for _ in range(result['skipped']):
+            DEADLINE.skip()
+    return add
+
+
+def run_shard(event: dict, context=None):
+    """
+    Worker of a shard: fetches its keys with its share of the rate limit and reports back to the coordinator.
+
+    :param event: {'worker': get_api, 'shard', 'shards', 'keys' or 'keys_key', 'expires_at'}; 'keys_key' is the
+        S3 object holding the keys of an invoked shard (see sharding.dispatch).
+    :param context: Lambda context of the worker, None locally.
+    :return: {'done': processed keys, 'dead_letters': failed or skipped keys, 'skipped': count}, or
+        {'result_key': S3 object holding it} when the keys came by reference.
+    """
+    global DEADLINE, DEAD_LETTERS
+    DEADLINE = scheduler.Deadline(context, expires_at=event.get('expires_at'))
+    DEAD_LETTERS = list()
+    financial.share_rate_limit(event['shards'])
+    financial.use_run(event.get('run_id'))
+    financial.RETRY_BUDGET.reset()
+    done = FETCHERS[event['worker']](sharding.event_keys(event))
+    print(f"---shard {event['shard']}/{event['shards']}: {len(done)} keys done---")
+    return sharding.reply(event, dict(done=done, dead_letters=DEAD_LETTERS, skipped=DEADLINE.skipped))
+
+
 def lambda_handler(event, context):
-    financial.delete_json_files()
-    etl()
-    profile()
-    historical_price_full()
+    """
+    Runs the extraction stages within the time budget of the invocation.
+
+    When the budget runs out, the requests not started go to the dead letters, the stage is flushed and
+    the run continues in a new invocation from that stage (see scheduler.continue_run). Past the
+    continuation cap the remaining stages are skipped; the stages done are still promoted and the dbt
+    build started.
+
+    Without raw staging the raw files of the previous run are deleted by the first invocation. With raw
+    staging (raw_staging=true) each run writes to its own prefix and every table is switched to it once
+    its stage has finished, so a failed run leaves the previous data readable.
+
+    :param event: Empty for a scheduled run, the checkpoint {'stage', 'resume', 'continuation', 'run_id'}, or
+        the event of a shard worker (see extract).
+    :param context: Lambda context, or scheduler.FakeContext / None locally.
+    :return: The continuation event, None when the run finished, or the result of a shard worker.
+    """
+    global DEADLINE, DEAD_LETTERS, RUN_ID
+    event = event or dict()
+    if 'worker' in event:
+        return run_shard(event, context)
+    event = dict(event, run_id=event.get('run_id') or datetime.now().strftime('%Y%m%d%H%M%S'))
+    RUN_ID = event['run_id']
+    financial.use_run(RUN_ID)
+    DEADLINE = scheduler.Deadline(context)
+    DEAD_LETTERS = list()
+    financial.share_rate_limit()
+    financial.RETRY_BUDGET.reset()
+    financial.ATHENA_STATS.clear()
+    if 'stage' not in event and not financial.RAW_STAGING:
+        financial.delete_json_files()
+        for table_name in financial.RAW_FOLDERS:
+            financial.register_partition_projection(table_name)
+    for stage in STAGES[STAGES.index(event.get('stage', STAGES[0])):]:
+        resume = stage == event.get('stage') and event.get('resume', False)
+        if DEADLINE.expired():
+            continuation = scheduler.continue_run(context, dict(event, stage=stage, resume=resume))
+            if continuation is not None:
+                return continuation
+            # Continuation cap reached: the remaining stages are skipped, the finished ones still go to dbt.
+            if resume:
+                financial.promote_run(STAGE_TABLES[stage])
+            break
+        if stage == 'etl':
+            etl(resume)
+        elif stage == 'profile':
+            profile()
+        else:
+            historical_price_full()
+        if DEADLINE.skipped:
+            continuation = scheduler.continue_run(context, dict(event, stage=stage, resume=True))
+            if continuation is not None:
+                return continuation
+            financial.promote_run(STAGE_TABLES[stage])
+            break
+        financial.promote_run(STAGE_TABLES[stage])
+    print(f'---Athena: {dict(financial.ATHENA_STATS)}---')
     # financial.crawler_start()
-    financial.start_codebuild()
\ No newline at end of file
+    financial.start_codebuild()
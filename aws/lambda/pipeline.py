@@ -0,0 +1,128 @@
+import os
+import queue
+import threading
+import time
+import financial
+import query_cache
+
+QUEUE_SIZE = int(os.environ.get('queue_size', 1000))
+FLUSH_ROWS = int(os.environ.get('flush_rows', 10000))
+FLUSH_SECONDS = float(os.environ.get('flush_seconds', 60))
+
+_STOP = object()
+
+
+class Pipeline:
+    """
+    Bounded queue between the fetch workers and a writer thread that uploads the results to S3.
+
+    Workers `put` results as soon as they arrive; when the queue is full they block until the writer
+    catches up, so memory stays constant whatever the size of the backlog. The writer flushes every
+    `flush_rows` rows into a RollingWriter, which appends the data to large compressed objects. Every
+    `flush_seconds` the buffered rows are flushed and the open objects completed, so what was fetched
+    is readable in S3 within that time even if the run is killed afterwards.
+
+    Example:
+        with Pipeline('profile') as sink:
+            engine.run(partial(request_and_save, fn, spec, sink) for spec in specs)
+    """
+    def __init__(self, folder_save: str, flush_rows: int = FLUSH_ROWS, flush_seconds: float = FLUSH_SECONDS,
+                 queue_size: int = QUEUE_SIZE):
+        """
+        Initializes the Pipeline class.
+
+        Parameters:
+            folder_save (str): Folder of the raw bucket where the files are saved.
+            flush_rows (int): Rows buffered by the writer before a file is uploaded.
+            flush_seconds (float): Maximum seconds a row waits before being readable in S3.
+            queue_size (int): Maximum number of results waiting for the writer.
+
+        Returns:
+            None
+        """
+        self.folder_save = folder_save
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.rows = 0
+        self.files = 0
+        self.error = None
+        self._writer = financial.raw_writer()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def put(self, item, size: int = 1):
+        """
+        Sends a result to the writer, blocking while the queue is full.
+
+        Parameters:
+            item: Result to save (a row, or a historical_price_full response).
+            size (int): Number of rows the item produces, used for the flush threshold.
+
+        Returns:
+            None
+        """
+        self._queue.put((item, size))
+
+    def close(self):
+        """
+        Flushes what is left and waits for the writer to finish.
+
+        Returns:
+            None
+        """
+        self._queue.put(_STOP)
+        self._thread.join()
+        query_cache.invalidate(self.folder_save)
+        print(f'---{self.folder_save}: {self.rows} rows saved in {self.files} objects---')
+        if self.error is not None:
+            raise self.error
+
+    def _drain(self):
+        buffer = list()
+        size = 0
+        deadline = time.monotonic() + self.flush_seconds
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                self._flush(buffer, size)
+                self._close_writer()
+                return
+            if item is not None:
+                buffer.append(item[0])
+                size += item[1]
+            now = time.monotonic()
+            if size >= self.flush_rows or now >= deadline:
+                self._flush(buffer, size)
+                buffer = list()
+                size = 0
+            if now >= deadline:
+                self._close_writer()
+                deadline = now + self.flush_seconds
+
+    def _flush(self, buffer: list, size: int):
+        if not buffer or self.error is not None:
+            return
+        try:
+            financial.UploadS3(file=buffer, folder_save=self.folder_save, writer=self._writer).save_s3()
+            self.rows += size
+        except Exception as e:
+            print(f'Upload error: {e}')
+            self.error = e
+
+    def _close_writer(self):
+        try:
+            self._writer.close()
+            self.files = len(self._writer.keys)
+        except Exception as e:
+            print(f'Upload error: {e}')
+            self.error = self.error or e
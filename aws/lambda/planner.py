@@ -0,0 +1,164 @@
+import os
+import threading
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+DAYS_BEFORE = 10
+DAYS_AFTER = 30
+MAX_GAP = int(os.environ.get('historical_max_gap', 60))
+MAX_SPAN = int(os.environ.get('historical_max_span', 3650))
+# earning_calendar: a response with ROW_CAP rows or more is assumed truncated by the API and is split.
+ROW_CAP = int(os.environ.get('earning_row_cap', 4000))
+WINDOW_FILL = float(os.environ.get('earning_window_fill', 0.5))
+INITIAL_DAYS = int(os.environ.get('earning_initial_days', 3))
+MAX_DAYS = int(os.environ.get('earning_max_days', 90))
+
+
+def coalesce_windows(keys: list, days_before: int = DAYS_BEFORE, days_after: int = DAYS_AFTER,
+                     max_gap: int = MAX_GAP, max_span: int = MAX_SPAN):
+    """
+    Groups the pending (symbol, date) keys by symbol and merges their -10/+30 day windows.
+
+    Windows that overlap, touch or are separated by at most `max_gap` days are fetched as a single range,
+    as long as the range does not exceed `max_span` days. Quarterly earnings dates of the same symbol are
+    therefore fetched with one request instead of one per date.
+
+    Parameters:
+        keys (list): Pending keys as (symbol, 'YYYY-MM-DD') pairs.
+        days_before (int): Days requested before each search date.
+        days_after (int): Days requested after each search date.
+        max_gap (int): Largest gap in days between two windows that is still merged.
+        max_span (int): Largest range in days of a single request.
+
+    Returns:
+        list: One dict per request with the keys 'symbol', 'from', 'to' (dates) and 'dates' (search dates).
+
+    Example:
+        coalesce_windows([('AAPL', '2023-01-20'), ('AAPL', '2023-02-05')])
+        # [{'symbol': 'AAPL', 'from': date(2023, 1, 10), 'to': date(2023, 3, 7),
+        #   'dates': ['2023-01-20', '2023-02-05']}]
+    """
+    by_symbol = defaultdict(set)
+    for symbol, date in keys:
+        by_symbol[symbol].add(date)
+
+    windows = list()
+    for symbol in sorted(by_symbol):
+        current = None
+        for date in sorted(by_symbol[symbol]):
+            search_date = datetime.strptime(date, '%Y-%m-%d').date()
+            start_date = search_date - timedelta(days=days_before)
+            end_date = search_date + timedelta(days=days_after)
+            if (current is not None
+                    and (start_date - current['to']).days <= max_gap + 1
+                    and (end_date - current['from']).days <= max_span):
+                current['to'] = max(current['to'], end_date)
+                current['dates'].append(date)
+            else:
+                current = {'symbol': symbol, 'from': start_date, 'to': end_date, 'dates': [date]}
+                windows.append(current)
+    return windows
+
+
+def split_window(window: dict, response: dict, days_before: int = DAYS_BEFORE, days_after: int = DAYS_AFTER):
+    """
+    Fans the bars of a merged range back out to each search date of the window.
+
+    Parameters:
+        window (dict): Window returned by coalesce_windows.
+        response (dict): API response with the keys 'symbol' and 'historical'.
+        days_before (int): Days kept before each search date.
+        days_after (int): Days kept after each search date.
+
+    Returns:
+        list: One response per search date, with 'search_date' set and only the bars of its window.
+    """
+    historical = response.get('historical', [])
+    responses = list()
+    for date in window['dates']:
+        search_date = datetime.strptime(date, '%Y-%m-%d').date()
+        start_date = str(search_date - timedelta(days=days_before))
+        end_date = str(search_date + timedelta(days=days_after))
+        bars = [bar for bar in historical if start_date <= bar['date'][:10] <= end_date]
+        if bars:
+            responses.append(dict(symbol=window['symbol'], search_date=date, historical=bars))
+    return responses
+
+
+class DensityWindows:
+    """
+    Splits an earnings date range into consecutive windows sized on the row density observed so far.
+
+    The first windows are INITIAL_DAYS long. Each response reports its rows per day through `observe`, and
+    the next windows are sized so that they are expected to return `fill` * `row_cap` rows: long windows
+    in quiet periods, short ones around earnings seasons. Iterating is lazy, so when the windows are fed
+    to engine.run each new window uses the density of every response received until then.
+
+    Example:
+        windows = DensityWindows(date(2020, 1, 1), date(2024, 1, 1))
+        for start_date, end_date in windows:
+            rows = fetch(start_date, end_date)
+            windows.observe(start_date, end_date, len(rows))
+    """
+    def __init__(self, start_date: date, end_date: date, row_cap: int = ROW_CAP, fill: float = WINDOW_FILL,
+                 initial_days: int = INITIAL_DAYS, max_days: int = MAX_DAYS):
+        """
+        Initializes the DensityWindows class.
+
+        Parameters:
+            start_date (date): First day of the range.
+            end_date (date): Last day of the range (inclusive).
+            row_cap (int): Maximum rows the API returns in one response.
+            fill (float): Fraction of row_cap a window aims for, leaving room for denser days.
+            initial_days (int): Size of the windows before any response was observed.
+            max_days (int): Largest window.
+
+        Returns:
+            None
+        """
+        self.start_date = start_date
+        self.end_date = end_date
+        self.row_cap = row_cap
+        self.fill = fill
+        self.initial_days = initial_days
+        self.max_days = max_days
+        self.rows = 0
+        self.days = 0
+        self._lock = threading.Lock()
+
+    def observe(self, start_date: date, end_date: date, rows: int):
+        """
+        Records the number of rows returned for a window.
+        """
+        with self._lock:
+            self.rows += rows
+            self.days += (end_date - start_date).days + 1
+
+    def window_days(self):
+        """
+        Returns:
+            int: Size in days of the next window.
+        """
+        with self._lock:
+            if self.days == 0:
+                return self.initial_days
+            density = max(self.rows / self.days, 1e-6)
+        return max(1, min(self.max_days, int(self.row_cap * self.fill / density)))
+
+    def __iter__(self):
+        cursor = self.start_date
+        while cursor <= self.end_date:
+            stop = min(self.end_date, cursor + timedelta(days=self.window_days() - 1))
+            yield cursor, stop
+            cursor = stop + timedelta(days=1)
+
+
+def bisect(start_date: date, end_date: date):
+    """
+    Splits a window of two days or more into two halves.
+
+    Returns:
+        list: [(start_date, middle), (middle + 1 day, end_date)].
+    """
+    middle = start_date + timedelta(days=(end_date - start_date).days // 2)
+    return [(start_date, middle), (middle + timedelta(days=1), end_date)]
@@ -0,0 +1,109 @@
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by every request made to the API.
+
+    Tokens are added at `rate` per second up to `burst`; each request takes one token and waits when
+    the bucket is empty. When the API answers 429 the bucket stops handing out tokens until the
+    Retry-After delay has passed and halves its rate, then recovers it gradually on each success.
+    """
+    def __init__(self, rate: float, burst: int, min_rate: float = None):
+        """
+        Initializes the TokenBucket class.
+
+        Parameters:
+            rate (float): Requests per second allowed by the API quota (e.g. 300 per minute -> 5).
+            burst (int): Maximum number of requests that can be made at once after an idle period.
+            min_rate (float): Lowest rate the bucket may fall to after repeated 429 responses.
+
+        Returns:
+            None
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min_rate or rate / 10
+        self.burst = burst
+        self.tokens = float(burst)
+        self.blocked_until = 0.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: int = 1):
+        """
+        Blocks until `tokens` can be taken from the bucket.
+
+        Parameters:
+            tokens (int): Number of tokens consumed by the request.
+
+        Returns:
+            None
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.blocked_until and self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = max(self.blocked_until - now, (tokens - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def throttle(self, retry_after: float = None):
+        """
+        Called when the API answers 429: pauses the bucket and halves its rate.
+
+        Parameters:
+            retry_after (float): Seconds to wait, as sent by the API. Defaults to one token interval.
+
+        Returns:
+            None
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0.0
+            self._updated = now
+            self.blocked_until = max(self.blocked_until, now + (retry_after or 1 / self.rate))
+            print(f'Rate limited, waiting {self.blocked_until - now:.2f}s. New rate {self.rate:.2f} req/s.')
+
+    def success(self):
+        """
+        Called after a successful request, raises the rate back towards the configured one.
+
+        Returns:
+            None
+        """
+        if self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+def retry_after_seconds(value: str):
+    """
+    Converts a Retry-After header, in seconds or HTTP date format, to seconds.
+
+    Parameters:
+        value (str): Header value.
+
+    Returns:
+        float: Seconds to wait, or None when the header is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,216 @@
+import gzip
+import io
+import os
+import uuid
+from datetime import datetime
+
+MB = 1024 * 1024
+OBJECT_SIZE = int(os.environ.get('object_size_mb', 128)) * MB
+PART_SIZE = int(os.environ.get('part_size_mb', 8)) * MB
+RAW_COMPRESSION = os.environ.get('raw_compression', 'gzip')
+EXTENSIONS = dict(gzip='.gz', zstd='.zst', none='')
+
+
+class MultipartWriter(io.RawIOBase):
+    """
+    Write-only file object that streams its content to an S3 object.
+
+    Small objects are sent with a single put_object on close; as soon as the buffered data reaches
+    `part_size` a multipart upload is started and the object is uploaded part by part, so memory use is
+    bounded by one part whatever the object size.
+    """
+    def __init__(self, client, bucket: str, key: str, part_size: int = PART_SIZE):
+        """
+        Initializes the MultipartWriter class.
+
+        Parameters:
+            client: boto3 S3 client.
+            bucket (str): Destination bucket.
+            key (str): Destination key.
+            part_size (int): Bytes per uploaded part (S3 requires at least 5 MB for all but the last part).
+
+        Returns:
+            None
+        """
+        super().__init__()
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self._buffer = bytearray()
+        self._parts = list()
+        self._upload_id = None
+        self._size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        self._size += len(data)
+        if len(self._buffer) >= self.part_size:
+            self._upload_part()
+        return len(data)
+
+    def tell(self):
+        return self._size
+
+    def _upload_part(self):
+        if self._upload_id is None:
+            self._upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key)['UploadId']
+        number = len(self._parts) + 1
+        response = self.client.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                           PartNumber=number, Body=bytes(self._buffer))
+        self._parts.append({'ETag': response['ETag'], 'PartNumber': number})
+        self._buffer = bytearray()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._upload_id is None:
+                if self._size:
+                    self.client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer))
+            else:
+                if self._buffer:
+                    self._upload_part()
+                self.client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                                                      MultipartUpload={'Parts': self._parts})
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            super().close()
+
+    def abort(self):
+        if self._upload_id is not None:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            self._upload_id = None
+
+
+class _Stream:
+    def __init__(self, client, bucket: str, key: str, file_format: str, compression: str, part_size: int,
+                 root: str = None):
+        if root is None:
+            self.raw = MultipartWriter(client, bucket, key, part_size)
+        else:
+            path = os.path.join(root, key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.raw = open(path, 'wb')
+        self.file_format = file_format
+        if file_format == 'parquet':
+            self.encoder = None
+        elif compression == 'gzip':
+            self.encoder = gzip.GzipFile(fileobj=self.raw, mode='wb')
+        elif compression == 'zstd':
+            import zstandard
+            self.encoder = zstandard.ZstdCompressor().stream_writer(self.raw, closefd=False)
+        else:
+            self.encoder = self.raw
+
+    def write(self, data):
+        if self.file_format == 'parquet':
+            import pyarrow.parquet as pq
+            if self.encoder is None:
+                self.encoder = pq.ParquetWriter(self.raw, data.schema, compression=data.compression)
+            self.encoder.write_table(data.table, row_group_size=data.row_group_size)
+        else:
+            self.encoder.write(data)
+
+    def close(self):
+        if self.encoder is not None and self.encoder is not self.raw:
+            self.encoder.close()
+        self.raw.close()
+
+
+class RollingWriter:
+    """
+    Writes the raw files of a run as few, large, compressed objects.
+
+    Data sent to the same prefix (partition) is appended to one open object until it reaches
+    `object_size` bytes, then the object is completed and a new one is started. NDJSON is compressed on
+    the fly with gzip or zstd; Parquet tables are appended as row groups of a single file.
+
+    With a `root` directory the objects are written as local files under the same keys instead, e.g. for
+    a backfill run from a workstation.
+
+    Example:
+        writer = RollingWriter(s3, 'bucket', 'json')
+        writer.write('earning_calendar/data_process=2024-01-02/year=2024', to_ndjson(rows))
+        writer.close()
+    """
+    def __init__(self, client, bucket: str, file_format: str = 'json', compression: str = RAW_COMPRESSION,
+                 object_size: int = OBJECT_SIZE, part_size: int = PART_SIZE, root: str = None):
+        """
+        Initializes the RollingWriter class.
+
+        Parameters:
+            client: boto3 S3 client.
+            bucket (str): Destination bucket.
+            file_format (str): 'json' (NDJSON) or 'parquet'.
+            compression (str): 'gzip', 'zstd' or 'none'. Ignored for Parquet, which compresses internally.
+            object_size (int): Target size in bytes of each object.
+            part_size (int): Multipart upload part size in bytes.
+            root (str): Local directory to write to instead of the bucket, None for S3.
+
+        Returns:
+            None
+        """
+        self.client = client
+        self.bucket = bucket
+        self.file_format = file_format
+        self.compression = 'none' if file_format == 'parquet' else compression
+        self.object_size = object_size
+        self.part_size = part_size
+        self.root = root
+        self.keys = list()
+        self._streams = dict()
+
+    def _key(self, prefix: str):
+        name = datetime.now().strftime('%Y%m%d%H%M%S%f')
+        return f'{prefix}/{name}-{uuid.uuid4().hex[:8]}.{self.file_format}{EXTENSIONS[self.compression]}'
+
+    def write(self, prefix: str, data):
+        """
+        Appends data to the open object of the prefix.
+
+        Parameters:
+            prefix (str): Folder (partition) of the object, without trailing slash.
+            data: NDJSON bytes, or a ParquetPart for the Parquet format.
+
+        Returns:
+            None
+        """
+        stream = self._streams.get(prefix)
+        if stream is None:
+            key = self._key(prefix)
+            stream = _Stream(self.client, self.bucket, key, self.file_format, self.compression, self.part_size,
+                             self.root)
+            self._streams[prefix] = stream
+            self.keys.append(key)
+        stream.write(data)
+        if stream.raw.tell() >= self.object_size:
+            stream.close()
+            del self._streams[prefix]
+
+    def close(self):
+        """
+        Completes every open object. The writer stays usable: the next write to a prefix starts a new object.
+
+        Returns:
+            None
+        """
+        streams, self._streams = self._streams, dict()
+        for stream in streams.values():
+            stream.close()
+
+
+class ParquetPart:
+    """
+    Arrow table and the Parquet options used to append it to a RollingWriter.
+    """
+    def __init__(self, table, compression: str, row_group_size: int):
+        self.table = table
+        self.schema = table.schema
+        self.compression = compression
+        self.row_group_size = row_group_size
@@ -0,0 +1,108 @@
+import json
+import os
+import threading
+import time
+import financial
+
+RESERVE_SECONDS = float(os.environ.get('deadline_reserve_seconds', 120))
+MAX_CONTINUATIONS = int(os.environ.get('max_continuations', 10))
+
+
+class Deadline:
+    """
+    Time budget of an invocation, read from the Lambda context.
+
+    The budget is considered spent when less than `reserve_seconds` remain: that reserve is what the
+    requests already in flight, the last flush to S3 and the checkpoint need to finish before the
+    timeout. Without a context (local run) the budget never runs out.
+
+    Example:
+        deadline = Deadline(context)
+        if deadline.expired():
+            deadline.skip()
+    """
+    def __init__(self, context=None, reserve_seconds: float = RESERVE_SECONDS, expires_at: float = None):
+        """
+        Initializes the Deadline class.
+
+        Parameters:
+            context: Lambda context (or FakeContext), None for no deadline.
+            reserve_seconds (float): Seconds kept free before the timeout.
+            expires_at (float): Optional epoch time the work must be done by, e.g. the deadline of the
+                coordinator of a shard, when it comes before the timeout of this invocation.
+
+        Returns:
+            None
+        """
+        self.context = context
+        self.reserve_seconds = reserve_seconds
+        self.expires_at = expires_at
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        """
+        Returns:
+            float: Seconds left before the timeout (infinite without a context nor expires_at).
+        """
+        remaining = float('inf')
+        if self.context is not None:
+            remaining = self.context.get_remaining_time_in_millis() / 1000
+        if self.expires_at is not None:
+            remaining = min(remaining, self.expires_at - time.time())
+        return remaining
+
+    def expired(self):
+        return self.remaining() <= self.reserve_seconds
+
+    def skip(self):
+        """
+        Counts a task that was not started because the budget was spent.
+        """
+        with self._lock:
+            self.skipped += 1
+
+
+class FakeContext:
+    """
+    Stand-in for the Lambda context, to run the handler and its deadline logic locally.
+
+    Example:
+        event = lambda_handler(dict(), FakeContext(seconds=200))
+        while event:
+            event = lambda_handler(event, FakeContext(seconds=200))
+    """
+    def __init__(self, seconds: float = 900, function_name: str = 'financial-local'):
+        self.function_name = function_name
+        self.invoked_function_arn = function_name
+        self._end = time.monotonic() + seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._end - time.monotonic()) * 1000))
+
+
+def continue_run(context, event: dict):
+    """
+    Carries the run on in a new invocation of the same function, with the event as checkpoint.
+
+    With a FakeContext (or no context) nothing is invoked: the continuation event is only returned, so
+    the caller decides how to go on. After MAX_CONTINUATIONS chained invocations the run stops, leaving
+    the pending keys in the dead letters for the next scheduled run: None is returned and the caller
+    skips the remaining stages, but still promotes the stages already done and starts the dbt build.
+
+    Parameters:
+        context: Lambda context of the current invocation.
+        event (dict): Checkpoint, with the stage to resume from.
+
+    Returns:
+        dict: Event of the continuation, or None when the run stops.
+    """
+    event = dict(event, continuation=event.get('continuation', 0) + 1)
+    if event['continuation'] > MAX_CONTINUATIONS:
+        print(f'Stopping after {MAX_CONTINUATIONS} continuations, pending work kept in the dead letters')
+        return None
+    print(f"Time budget spent, continuing at stage {event['stage']} (continuation {event['continuation']})")
+    if context is not None and not isinstance(context, FakeContext):
+        financial.lambda_client.invoke(FunctionName=context.invoked_function_arn, InvocationType='Event',
+                                       Payload=json.dumps(event))
+    return event
@@ -0,0 +1,260 @@
+"""
+Local backfill of the raw tables over a date range, spread across a process pool.
+
+The range is cut into chunks of --chunk-days; each worker process extracts the earnings calendar of a
+chunk (windows sized on the observed density, see planner.DensityWindows) and writes it. The profiles
+and historical prices of the earnings found are then fetched in batches of keys, each batch by a worker
+(main.run_shard). Every worker fetches, flattens and serializes its own data, with a 1/N share of the
+API rate limit of the .env.
+
+Output goes to the raw bucket (--output s3) or to a local directory with the same partition layout.
+In the raw bucket the files are staged under runs/<run_id>/ (see financial.use_run), whatever the
+raw_staging setting, so neither the next scheduled run's cleanup nor a staged run's promotion removes
+them before they are loaded. At the end the raw tables that got data are promoted to the backfill's
+prefix and the dbt build is started, as at the end of a Lambda run.
+Progress is saved in a JSON checkpoint after every finished task: running the same command again skips
+what is done and retries the failed windows and keys.
+
+Usage:
+    python main.py backfill --from 2019-01-01 --to 2023-12-31 --workers 8
+    python main.py backfill --from 2023-01-01 --to 2023-12-31 --symbols AAPL,MSFT --output ./raw \\
+        --checkpoint aapl_msft.json
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import engine
+import financial
+import main
+import pipeline
+import planner
+import sharding
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from functools import partial
+
+STAGES = ('earning_calendar', 'profile', 'historical_price_full')
+
+
+class KeySink:
+    """
+    Pipeline wrapper for the earnings rows: drops the symbols not requested and records the
+    (symbol, date) keys of what is saved, which the profile and historical stages fetch afterwards.
+    """
+    def __init__(self, sink: pipeline.Pipeline, symbols: set = None):
+        self.sink = sink
+        self.symbols = symbols
+        self.keys = set()
+
+    def put(self, item, size: int = 1):
+        if self.symbols is not None and item.get('symbol') not in self.symbols:
+            return
+        self.keys.add((item.get('symbol'), item.get('date')))
+        self.sink.put(item, size)
+
+
+def init_worker(output: str, workers: int, run_id: str = None):
+    """
+    Initializer of the worker processes: output location, staging prefix of the run and share of the
+    API rate limit.
+    """
+    financial.use_output(output)
+    use_run(run_id)
+    financial.share_rate_limit(workers)
+
+
+def use_run(run_id: str = None):
+    """
+    Stages the raw files of an S3 backfill under runs/<run_id>/, even when the Lambda does not stage.
+    """
+    if run_id:
+        financial.RAW_STAGING = True
+    financial.use_run(run_id)
+
+
+def promote(checkpoint):
+    """
+    Points the raw tables that got data at the backfill's prefix and starts the dbt build.
+    """
+    state = checkpoint.state
+    tables = [table for table, done in (('earning_calendar', state['keys']), ('profile', state['profile']),
+                                        ('historical_price_full', state['historical_price_full'])) if done]
+    for table_name in tables:
+        financial.promote_run(table_name)
+    if tables:
+        financial.start_codebuild()
+        print(f"{', '.join(tables)} promoted to {financial.RUN_PREFIX}, dbt build started")
+
+
+def fetch_earning_calendar(start_date: str, end_date: str, symbols: list = None):
+    """
+    Extracts the earnings calendar of a chunk of the range (runs in a worker process).
+
+    Parameters:
+        start_date (str): First day of the chunk, YYYY-MM-DD.
+        end_date (str): Last day of the chunk, YYYY-MM-DD.
+        symbols (list): Symbols kept, None for all.
+
+    Returns:
+        dict: {'keys': [[symbol, date], ...] saved, 'dead_letters': windows that failed}.
+    """
+    fn = financial.Financial()
+    get_api = 'earning_calendar'
+    main.DEAD_LETTERS = list()
+    density = planner.DensityWindows(date.fromisoformat(start_date), date.fromisoformat(end_date))
+    with pipeline.Pipeline(get_api) as writer:
+        sink = KeySink(writer, set(symbols) if symbols else None)
+        engine.run(partial(main.request_and_save, fn,
+                           financial.RequestSpec(get_api, start_date=start, end_date=end), sink, density=density)
+                   for start, end in density)
+    return dict(keys=sorted([list(key) for key in sink.keys]), dead_letters=main.DEAD_LETTERS)
+
+
+def chunks(start_date: date, end_date: date, days: int):
+    """
+    Returns:
+        list: Consecutive [from, to] windows of `days` days covering the range, as YYYY-MM-DD strings.
+    """
+    windows = list()
+    while start_date <= end_date:
+        stop = min(end_date, start_date + timedelta(days=days - 1))
+        windows.append([str(start_date), str(stop)])
+        start_date = stop + timedelta(days=1)
+    return windows
+
+
+class Checkpoint:
+    """
+    Progress of a backfill, kept in a JSON file rewritten after every finished task.
+
+    earning_calendar holds the windows still to extract (failed windows are added back), keys the
+    (symbol, date) earnings found so far, and profile / historical_price_full the keys already fetched.
+    run_id is the staging prefix of an S3 backfill, kept so that a resumed backfill adds to the same run.
+    """
+    def __init__(self, path: str, args):
+        self.path = path
+        self.state = dict(start_date=args.start_date, end_date=args.end_date, symbols=args.symbols,
+                          run_id=datetime.now().strftime('%Y%m%d%H%M%S') if args.output == 's3' else None,
+                          earning_calendar=chunks(date.fromisoformat(args.start_date),
+                                                  date.fromisoformat(args.end_date), args.chunk_days),
+                          keys=list(), profile=list(), historical_price_full=list())
+        if os.path.exists(path):
+            with open(path) as file:
+                state = json.load(file)
+            for field in ('start_date', 'end_date', 'symbols'):
+                if state[field] != self.state[field]:
+                    raise SystemExit(f'{path} is the checkpoint of another backfill ({field}: {state[field]}), '
+                                     f'use another --checkpoint')
+            self.state = state
+            print(f'Resuming from {path}')
+
+    def save(self):
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as file:
+            json.dump(self.state, file)
+        os.replace(tmp, self.path)
+
+
+def run_earning_calendar(executor, checkpoint: Checkpoint, symbols: list):
+    state = checkpoint.state
+    pending = list(state['earning_calendar'])
+    print(f'earning_calendar: {len(pending)} windows')
+    futures = {executor.submit(fetch_earning_calendar, window[0], window[1], symbols): window for window in pending}
+    keys = set(tuple(key) for key in state['keys'])
+    failed = 0
+    for future in as_completed(futures):
+        window = futures[future]
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f'earning_calendar {window[0]} to {window[1]} error: {e}')
+            failed += 1
+            continue
+        keys.update(tuple(key) for key in result['keys'])
+        state['earning_calendar'].remove(window)
+        state['earning_calendar'].extend([key['from'], key['to']] for key in result['dead_letters'])
+        failed += len(result['dead_letters'])
+        state['keys'] = sorted(list(key) for key in keys)
+        checkpoint.save()
+    print(f'---earning_calendar: {len(keys)} earnings, {failed} windows failed---')
+
+
+def run_keys(executor, checkpoint: Checkpoint, get_api: str, keys: list, workers: int, batch_size: int,
+             run_id: str = None):
+    """
+    Fetches the keys not done yet in batches, partitioned by symbol so that the historical windows of a
+    symbol are still merged by one worker.
+    """
+    state = checkpoint.state
+    done = set(tuple(key) for key in state[get_api])
+    column = ('symbol',) if get_api == 'profile' else ('symbol', 'date')
+    pending = [dict(zip(column, key)) for key in keys if tuple(key) not in done]
+    print(f'{get_api}: {len(pending)} keys, {len(done)} already done')
+    if not pending:
+        return
+    batches = sharding.partition(pending, math.ceil(len(pending) / batch_size))
+    events = [dict(worker=get_api, shard=index, shards=workers, keys=batch, run_id=run_id)
+              for index, batch in enumerate(batches)]
+    futures = {executor.submit(main.run_shard, event): event for event in events}
+    failed = 0
+    for future in as_completed(futures):
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"{get_api} batch {futures[future]['shard']} error: {e}")
+            failed += len(futures[future]['keys'])
+            continue
+        done.update(tuple(key) for key in result['done'])
+        failed += len(result['dead_letters'])
+        state[get_api] = sorted(list(key) for key in done)
+        checkpoint.save()
+    print(f'---{get_api}: {len(done)} keys done, {failed} failed---')
+
+
+def cli(argv: list = None):
+    parser = argparse.ArgumentParser(prog='main.py backfill', description='Local backfill of the raw tables.')
+    parser.add_argument('--from', dest='start_date', required=True, help='First day, YYYY-MM-DD.')
+    parser.add_argument('--to', dest='end_date', required=True, help='Last day, YYYY-MM-DD.')
+    parser.add_argument('--symbols', type=lambda value: sorted(set(value.split(','))),
+                        help='Comma-separated symbols (default: every symbol of the earnings calendar).')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes.')
+    parser.add_argument('--output', default='s3', help="'s3' for the raw bucket, or a local directory.")
+    parser.add_argument('--checkpoint', default='backfill.json', help='Progress file (default: backfill.json).')
+    parser.add_argument('--chunk-days', type=int, default=30, help='Days of earnings per task (default: 30).')
+    parser.add_argument('--batch-size', type=int, default=500,
+                        help='profile / historical keys per task (default: 500).')
+    args = parser.parse_args(argv)
+
+    output = None if args.output == 's3' else os.path.abspath(args.output)
+    financial.use_output(output)
+    checkpoint = Checkpoint(args.checkpoint, args)
+    run_id = checkpoint.state.get('run_id')
+    if (output is None) != bool(run_id):
+        raise SystemExit(f'{args.checkpoint} is the checkpoint of a backfill with another --output, '
+                         f'use another --checkpoint')
+    use_run(run_id)
+    print(f"Backfill {args.start_date} to {args.end_date}, {args.workers} workers, "
+          f"output {output or 's3 ' + financial.RUN_PREFIX}")
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_worker, initargs=(output, args.workers, run_id)) as executor:
+        if 'earning_calendar' in args.stages:
+            run_earning_calendar(executor, checkpoint, args.symbols)
+        keys = checkpoint.state['keys']
+        if 'profile' in args.stages:
+            symbols = args.symbols or sorted(set(key[0] for key in keys))
+            run_keys(executor, checkpoint, 'profile', [[symb] for symb in symbols], args.workers, args.batch_size,
+                     run_id)
+        if 'historical_price_full' in args.stages:
+            run_keys(executor, checkpoint, 'historical_price_full', keys, args.workers, args.batch_size, run_id)
+    if run_id:
+        promote(checkpoint)
+    if checkpoint.state['earning_calendar']:
+        print(f"{len(checkpoint.state['earning_calendar'])} earning_calendar windows left, "
+              f"run the same command again to retry them")
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,58 @@
+"""
+Import-time benchmark of the ETL modules, to keep track of the Lambda cold start.
+
+Each run imports the module in a fresh interpreter; the time of an empty interpreter is subtracted.
+Importing must not make AWS calls nor load the heavy libraries, which are only imported when used.
+
+Usage:
+    python bench_import.py
+    python bench_import.py --module financial --runs 20
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ('boto3', 'awswrangler', 'pandas', 'numpy', 'pyarrow')
+
+
+def measure(code: str, runs: int):
+    """
+    Runs the code in a new interpreter `runs` times.
+
+    Parameters:
+        code (str): Python code passed to `python -c`.
+        runs (int): Number of runs.
+
+    Returns:
+        list: Wall time of each run in seconds.
+    """
+    times = list()
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import-time benchmark of the ETL modules.')
+    parser.add_argument('--module', default='main', help='Module to import (default: main).')
+    parser.add_argument('--runs', type=int, default=10, help='Number of imports (default: 10).')
+    args = parser.parse_args()
+
+    baseline = statistics.median(measure('pass', args.runs))
+    times = [value - baseline for value in measure(f'import {args.module}', args.runs)]
+    loaded = subprocess.run(
+        [sys.executable, '-c',
+         f'import sys, {args.module}; print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))'],
+        check=True, capture_output=True, text=True).stdout.strip()
+
+    print(f'import {args.module}: median {statistics.median(times) * 1000:.0f} ms, '
+          f'min {min(times) * 1000:.0f} ms, max {max(times) * 1000:.0f} ms ({args.runs} runs)')
+    print(f'heavy modules loaded at import: {loaded or "none"}')
+
+
+if __name__ == '__main__':
+    main()
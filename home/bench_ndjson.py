@@ -0,0 +1,102 @@
+"""
+Micro-benchmark of the raw file serialization: the NDJSON writer of UploadS3 against the string
+concatenation it replaced, across payload sizes.
+
+Payloads are synthetic API responses. For historical_price_full each key is one response with --bars
+bars, flattened to one line per bar; for earning_calendar each key is one row. Nothing is uploaded.
+
+Usage:
+    python bench_ndjson.py
+    python bench_ndjson.py --api earning_calendar --keys 1000 10000 100000 --runs 5
+"""
+import argparse
+import json
+import statistics
+import time
+from datetime import date, datetime, timedelta
+import financial
+
+
+def legacy_ndjson(folder_save: str, file: list):
+    """
+    Body built by UploadS3.save_s3 before the NDJSON writer: one string grown by concatenation.
+    """
+    envio = str()
+    new = dict(data_process=str(datetime.now().date()))
+    if folder_save != 'historical_price_full':
+        for dados in file:
+            envio = envio + '{}\n'.format(json.dumps(dados))
+    else:
+        for dados in file:
+            for e in dados:
+                if type(dados[e]) != list:
+                    new[e] = dados[e]
+                else:
+                    for i in dados[e]:
+                        for x in i:
+                            new[f'{e}_{x}'] = i[x]
+                        envio = envio + '{}\n'.format(json.dumps(new))
+    return envio.encode()
+
+
+def payload(get_api: str, keys: int, bars: int):
+    start_date = date(2023, 1, 1)
+    if get_api == 'earning_calendar':
+        return [dict(date=str(start_date + timedelta(days=index % 365)), symbol=f'S{index:06d}', eps=index / 7,
+                     epsEstimated=index / 9, time='amc', revenue=index * 1000.0, revenueEstimated=None,
+                     fiscalDateEnding='2023-03-31', updatedFromDate='2023-04-02') for index in range(keys)]
+    return [dict(symbol=f'S{index:06d}', search_date=str(start_date),
+                 historical=[dict(date=str(start_date + timedelta(days=bar)), open=100.0 + bar, high=101.5 + bar,
+                                  low=99.25 + bar, close=100.75 + bar, adjClose=100.75 + bar, volume=1234567.0,
+                                  unadjustedVolume=1234567.0, change=0.75, changePercent=0.75, vwap=100.5,
+                                  label=f'January {bar + 1}, 23', changeOverTime=0.0075)
+                             for bar in range(bars)])
+            for index in range(keys)]
+
+
+def current_ndjson(folder_save: str, file: list):
+    """
+    Body built by UploadS3 today: historical responses are flattened to a DataFrame, rows written by to_ndjson.
+    """
+    rows = financial.flatten_historical(file) if folder_save == 'historical_price_full' else file
+    return financial.to_ndjson(rows)
+
+
+def measure(function, runs: int):
+    times = list()
+    for _ in range(runs):
+        start = time.perf_counter()
+        body = function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), body
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmark of the raw NDJSON serialization.')
+    parser.add_argument('--api', choices=['historical_price_full', 'earning_calendar'], default='historical_price_full')
+    parser.add_argument('--keys', type=int, nargs='+', default=[100, 1000, 5000],
+                        help='Payload sizes, in keys (default: 100 1000 5000).')
+    parser.add_argument('--bars', type=int, default=40, help='Bars per historical key (default: 40).')
+    parser.add_argument('--runs', type=int, default=3, help='Runs per measure, the median is shown (default: 3).')
+    args = parser.parse_args()
+
+    backends = [('json', None)] + ([('orjson', financial.orjson)] if financial.orjson is not None else [])
+    print(f"{args.api}: median of {args.runs} runs, seconds")
+    print(f"{'keys':>8} {'lines':>9} {'concat':>8} " + ' '.join(f'{name:>8}' for name, _ in backends))
+    for keys in args.keys:
+        file = payload(args.api, keys, args.bars)
+        legacy, body = measure(lambda: legacy_ndjson(args.api, file), args.runs)
+        lines = body.count(b'\n')
+        row = f'{keys:>8} {lines:>9} {legacy:>8.3f}'
+        for name, module in backends:
+            financial.orjson = module
+            elapsed, body = measure(lambda: current_ndjson(args.api, file), args.runs)
+            count = body.count(b'\n')
+            assert count == lines, f'{name}: {count} lines instead of {lines}'
+            row += f' {elapsed:>8.3f}'
+        print(row)
+    financial.orjson = backends[-1][1]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Latency benchmark of the API connections: a new connection per call (requests.get) against the pooled
+keep-alive session of financial.get_session.
+
+The API is replaced by a local http.server stub answering a small JSON body over HTTP/1.1 keep-alive.
+--handshake adds a delay to every new connection, standing in for the TCP/TLS handshake with the real
+API that the pool saves. Calls are made sequentially, then from --threads threads.
+
+Usage:
+    python bench_session.py
+    python bench_session.py --calls 2000 --threads 8 --handshake 0.03
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+import financial
+
+BODY = json.dumps([{'symbol': 'AAPL', 'date': '2024-01-02', 'eps': 2.18}]).encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are sent separately: with Nagle, keep-alive calls would wait on the delayed ACK.
+    disable_nagle_algorithm = True
+    handshake = 0.0
+    connections = 0
+    _lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        with StubHandler._lock:
+            StubHandler.connections += 1
+        time.sleep(self.handshake)
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def measure(get, url: str, calls: int, threads: int):
+    """
+    Returns:
+        tuple: Median and 95th percentile latency per call in ms, total seconds, connections opened.
+    """
+    def call(_):
+        start = time.perf_counter()
+        response = get(url, params={'apikey': 'bench'}, timeout=financial.TIMEOUT)
+        response.raise_for_status()
+        response.json()
+        return (time.perf_counter() - start) * 1000
+
+    StubHandler.connections = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        latencies = sorted(executor.map(call, range(calls)))
+    elapsed = time.perf_counter() - start
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95)], elapsed, StubHandler.connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency benchmark of the API connections.')
+    parser.add_argument('--calls', type=int, default=500, help='Calls per measure (default: 500).')
+    parser.add_argument('--threads', type=int, default=financial.POOL_SIZE,
+                        help='Threads of the concurrent measure (default: pool_size).')
+    parser.add_argument('--handshake', type=float, default=0.0,
+                        help='Seconds added to every new connection (default: 0).')
+    args = parser.parse_args()
+
+    StubHandler.handshake = args.handshake
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/api/v3/earning_calendar'
+    session = financial.get_session(args.threads)
+
+    print(f'{args.calls} calls, handshake {args.handshake * 1000:.0f} ms')
+    print(f"{'mode':<22} {'threads':>7} {'p50 ms':>8} {'p95 ms':>8} {'total s':>8} {'conns':>6}")
+    for threads in (1, args.threads):
+        for name, get in (('requests.get', requests.get), ('get_session()', session.get)):
+            p50, p95, elapsed, connections = measure(get, url, args.calls, threads)
+            print(f'{name:<22} {threads:>7} {p50:>8.2f} {p95:>8.2f} {elapsed:>8.2f} {connections:>6}')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""
+Scaling benchmark of the sharded extraction: runs the same pending keys with 1, 2, 4... workers.
+
+Workers are local processes standing in for parallel Lambda invocations, and share the API rate limit
+of the .env (rate_limit / rate_burst). The raw files are written to the bucket as in a normal run, but
+the progress manifests and dead letters are left untouched.
+
+Usage:
+    python bench_shards.py --api profile --keys symbols.csv --shards 1 2 4 8
+    python bench_shards.py --api historical_price_full --keys pending.csv   # lines: symbol,date
+"""
+import argparse
+import csv
+import time
+import main
+
+
+def read_keys(path: str, get_api: str):
+    with open(path) as file:
+        rows = [row for row in csv.reader(file) if row]
+    if get_api == 'profile':
+        return [{'symbol': row[0]} for row in rows]
+    return [{'symbol': row[0], 'date': row[1]} for row in rows]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scaling benchmark of the sharded extraction.')
+    parser.add_argument('--api', choices=sorted(main.FETCHERS), default='profile')
+    parser.add_argument('--keys', required=True, help='CSV file with the pending keys.')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    keys = read_keys(args.keys, args.api)
+    print(f'{len(keys)} {args.api} keys')
+    for shards in args.shards:
+        main.DEAD_LETTERS = list()
+        start_time = time.time()
+        done = main.extract(args.api, keys, shards)
+        elapsed_time = time.time() - start_time
+        print(f'shards={shards}: {len(done)} keys done, {len(main.DEAD_LETTERS)} failed, '
+              f'{elapsed_time:.2f} seconds ({len(keys) / elapsed_time:.2f} keys/s)')
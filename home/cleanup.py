@@ -0,0 +1,63 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+DELETE_BATCH = 1000
+DELETE_WORKERS = int(os.getenv('delete_workers', 8))
+
+
+def list_keys(client, bucket: str, prefix: str = '', suffixes: tuple = None):
+    """
+    Lists every key under a prefix, following all the pages of list_objects_v2.
+
+    Parameters:
+        client: boto3 S3 client.
+        bucket (str): Bucket to list.
+        prefix (str): Key prefix.
+        suffixes (tuple): Only keys ending with one of these suffixes, all keys when None.
+
+    Returns:
+        generator: Keys, in listing order.
+    """
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if suffixes is None or obj['Key'].endswith(suffixes):
+                yield obj['Key']
+
+
+def delete_keys(client, bucket: str, keys, workers: int = DELETE_WORKERS):
+    """
+    Deletes the keys with delete_objects, 1000 keys per call and `workers` calls in parallel.
+
+    Parameters:
+        client: boto3 S3 client.
+        bucket (str): Bucket of the keys.
+        keys (iterable): Keys to delete. May be a generator, batches are sent while it is consumed.
+        workers (int): Number of delete_objects calls in flight.
+
+    Returns:
+        int: Number of keys deleted. Keys S3 failed to delete are printed.
+
+    Example:
+        delete_keys(s3, 'bucket', list_keys(s3, 'bucket', 'runs/20240102020000/'))
+    """
+    def delete(batch):
+        response = client.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': key} for key in batch],
+                                                                'Quiet': True})
+        for error in response.get('Errors', []):
+            print(f"Erro ao excluir {error['Key']}: {error.get('Message')}")
+        return len(batch) - len(response.get('Errors', []))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(delete, _batches(keys, DELETE_BATCH)))
+
+
+def _batches(keys, size: int):
+    batch = list()
+    for key in keys:
+        batch.append(key)
+        if len(batch) == size:
+            yield batch
+            batch = list()
+    if batch:
+        yield batch
@@ -0,0 +1,240 @@
+import io
+import os
+import cleanup
+import financial
+import query_cache
+from datetime import datetime
+
+# Progress tables: keys already processed by the extraction, loaded as an index by main.py.
+MANIFEST_TABLES = dict(
+    process_profile=('symbol',),
+    process_historical_price_full=('symbol', 'date'),
+)
+# Every append adds a delta part; above MAX_PARTS they are merged into a single sorted base file.
+MAX_PARTS = int(os.getenv('manifest_max_parts', 20))
+BASE_PREFIX = 'base-'
+KEY_SEPARATOR = '|'
+# Staging prefix of the UNLOADs that seed or migrate an index, outside the location of the progress tables.
+SEED_PREFIX = 'manifest_seed/'
+
+
+def ensure_table(table_name: str, database: str = os.getenv('data_base_name'),
+                 bucket_name: str = os.getenv('bucket_raw')):
+    """
+    Creates the progress table as a Parquet external table over s3://<bucket>/<table_name>/.
+
+    Tables created by older versions were plain text tables filled by INSERT INTO. They are migrated once:
+    their rows are UNLOADed as manifests, then the text files are deleted and the table is recreated as
+    Parquet on the same location. When the UNLOAD does not succeed nothing is deleted and the migration
+    is tried again on the next run.
+
+    Parameters:
+        table_name (str): One of MANIFEST_TABLES.
+        database (str): Glue database of the raw tables.
+        bucket_name (str): Raw bucket.
+
+    Returns:
+        None
+    """
+    columns = MANIFEST_TABLES[table_name]
+    create = f"""
+        CREATE EXTERNAL TABLE IF NOT EXISTS {table_name}(
+          {', '.join(f'{name} string' for name in columns)})
+        STORED AS PARQUET
+        LOCATION 's3://{bucket_name}/{table_name}/'
+    """
+    try:
+        table = financial.glue_client.get_table(DatabaseName=database, Name=table_name)['Table']
+    except financial.glue_client.exceptions.EntityNotFoundException:
+        financial.create_table(create, database)
+        return
+    if 'parquet' in table['StorageDescriptor'].get('InputFormat', '').lower():
+        return
+
+    print(f'Migrating {table_name} to Parquet manifests')
+    old_keys = list(cleanup.list_keys(financial.s3, bucket_name, f'{table_name}/'))
+    files = _unload(table_name, f"SELECT {', '.join(columns)} FROM {table_name}", '', database, bucket_name)
+    if files is None:
+        print(f'{table_name} not migrated, its text files are kept')
+        return
+    deleted = cleanup.delete_keys(financial.s3, bucket_name, old_keys)
+    print(f'{deleted} of {len(old_keys)} {table_name} text files deleted')
+    financial.create_table(f'DROP TABLE IF EXISTS {table_name}', database)
+    query_cache.invalidate(table_name)
+    financial.create_table(create, database)
+
+
+def append(table_name: str, keys: list, bucket_name: str = os.getenv('bucket_raw')):
+    """
+    Records processed keys by writing them as a new Parquet file in the location of the progress table.
+
+    Each call adds one small file, so checkpointing costs a single put_object whatever the number of keys,
+    and values are stored as data instead of being interpolated in SQL.
+
+    Parameters:
+        table_name (str): One of MANIFEST_TABLES.
+        keys (list): Processed keys, one list of values per key in the column order of the table.
+        bucket_name (str): Raw bucket.
+
+    Returns:
+        str: Key of the manifest written, or None when there was nothing to record.
+
+    Example:
+        append('process_historical_price_full', [['AAPL', '2024-01-25']])
+    """
+    if not keys:
+        return None
+    key = _write(table_name, keys, '', bucket_name)
+    print(f'{len(keys)} keys saved to {key}')
+    return key
+
+
+def seed(table_name: str, query: str, database: str = os.getenv('data_base_name'),
+         bucket_name: str = os.getenv('bucket_raw')):
+    """
+    Writes the base file of the index once, from the keys returned by an Athena query.
+
+    Used to include the keys already in the ref tables before the progress tables existed. Nothing is
+    done when the table already has a base file. The keys never go through the function: Athena UNLOADs
+    them as Parquet to a staging prefix and the files are copied in S3 as base files of the index. When
+    the query does not succeed nothing is copied, so the next run seeds again.
+
+    Parameters:
+        table_name (str): One of MANIFEST_TABLES.
+        query (str): Query returning the key columns of the table.
+        database (str): Athena database.
+        bucket_name (str): Raw bucket.
+
+    Returns:
+        None
+    """
+    if any(_is_base(key) for key in _list(table_name, bucket_name)):
+        return
+    files = _unload(table_name, query, BASE_PREFIX, database, bucket_name)
+    if files == 0:
+        _write(table_name, [], BASE_PREFIX, bucket_name)
+    if files is not None:
+        print(f'{table_name} index seeded with {files} files')
+
+
+def load_keys(table_name: str, candidates, bucket_name: str = os.getenv('bucket_raw')):
+    """
+    Returns which of the candidate keys are already in the index (the base file plus every delta part).
+
+    The index is never loaded as Python objects: each part is read as an Arrow table and filtered with
+    pyarrow.compute.is_in against the candidates, so memory follows the number of candidates (today's
+    keys) instead of the size of the whole history.
+
+    When there are more than MAX_PARTS files they are compacted into a new sorted base file, so loading
+    stays a handful of GETs whatever the number of runs. The compaction is also done in Arrow.
+
+    Parameters:
+        table_name (str): One of MANIFEST_TABLES.
+        candidates (iterable): Keys to check, as tuples in the column order of the table.
+        bucket_name (str): Raw bucket.
+
+    Returns:
+        set: The candidate keys already processed, as tuples.
+
+    Example:
+        done = load_keys('process_profile', [(symbol,) for symbol in new_symbols])
+        pending = [symbol for symbol in new_symbols if (symbol,) not in done]
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    columns = MANIFEST_TABLES[table_name]
+    wanted = pa.array(sorted({KEY_SEPARATOR.join(str(value) for value in key) for key in candidates}),
+                      type=pa.string())
+    parts = _list(table_name, bucket_name)
+    compact = len(parts) > MAX_PARTS
+    tables = list()
+    done = set()
+    for part in parts:
+        body = financial.s3.get_object(Bucket=bucket_name, Key=part)['Body'].read()
+        table = pq.read_table(io.BytesIO(body), columns=list(columns))
+        if compact:
+            tables.append(table)
+        if len(wanted):
+            found = table.filter(pc.is_in(_joined(table, columns), value_set=wanted))
+            done.update(zip(*[found[name].to_pylist() for name in columns]))
+    if compact:
+        merged = pa.concat_tables(tables).group_by(list(columns)).aggregate([])
+        base = _put(table_name, merged.sort_by([(name, 'ascending') for name in columns]), BASE_PREFIX, bucket_name)
+        cleanup.delete_keys(financial.s3, bucket_name, parts)
+        print(f'{len(parts)} {table_name} manifests compacted into {base}')
+    return done
+
+
+def _joined(table, columns: tuple):
+    """
+    Key column of the table: the single key column, or the columns joined with KEY_SEPARATOR.
+    """
+    import pyarrow.compute as pc
+
+    if len(columns) == 1:
+        return table[columns[0]]
+    return pc.binary_join_element_wise(*[table[name] for name in columns], KEY_SEPARATOR)
+
+
+def _unload(table_name: str, query: str, name_prefix: str, database: str, bucket_name: str):
+    """
+    UNLOADs the key columns returned by a query as Parquet to a staging prefix, then copies the files in S3
+    into the location of the progress table, so the keys never go through the function.
+
+    Returns:
+        int: Number of files added to the table, None when the query did not succeed (nothing is added).
+    """
+    columns = MANIFEST_TABLES[table_name]
+    stamp = datetime.now().strftime('%Y%m%d%H%M%S%f')
+    staging = f'{SEED_PREFIX}{table_name}/{stamp}/'
+    select = ', '.join(f'CAST("{name}" AS varchar) AS "{name}"' for name in columns)
+    query_execution = financial.execute_query(f"""
+        UNLOAD (SELECT {select} FROM ({query}))
+        TO 's3://{bucket_name}/{staging}'
+        WITH (format = 'PARQUET', compression = '{financial.PARQUET_COMPRESSION.upper()}')
+    """, database)
+    status = query_execution['Status']['State']
+    files = list(cleanup.list_keys(financial.s3, bucket_name, staging))
+    if status != 'SUCCEEDED':
+        cleanup.delete_keys(financial.s3, bucket_name, files)
+        print(f"{table_name} UNLOAD {status}: {query_execution['Status'].get('StateChangeReason', '')}")
+        return None
+    for index, file in enumerate(files):
+        financial.s3.copy_object(Bucket=bucket_name, CopySource=dict(Bucket=bucket_name, Key=file),
+                                 Key=f'{table_name}/{name_prefix}{stamp}-{index:05d}.parquet')
+    cleanup.delete_keys(financial.s3, bucket_name, files)
+    query_cache.invalidate(table_name)
+    return len(files)
+
+
+def _is_base(key: str):
+    return key.rsplit('/', 1)[-1].startswith(BASE_PREFIX)
+
+
+def _list(table_name: str, bucket_name: str):
+    paginator = financial.s3.get_paginator('list_objects_v2')
+    return [obj['Key']
+            for page in paginator.paginate(Bucket=bucket_name, Prefix=f'{table_name}/')
+            for obj in page.get('Contents', []) if obj['Key'].endswith('.parquet')]
+
+
+def _write(table_name: str, keys: list, name_prefix: str, bucket_name: str):
+    import pyarrow as pa
+
+    columns = MANIFEST_TABLES[table_name]
+    table = pa.table({name: pa.array([str(key[index]) for key in keys], type=pa.string())
+                      for index, name in enumerate(columns)})
+    return _put(table_name, table, name_prefix, bucket_name)
+
+
+def _put(table_name: str, table, name_prefix: str, bucket_name: str):
+    import pyarrow.parquet as pq
+
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression=financial.PARQUET_COMPRESSION)
+    key = f"{table_name}/{name_prefix}{datetime.now().strftime('%Y%m%d%H%M%S%f')}.parquet"
+    financial.s3.put_object(Bucket=bucket_name, Key=key, Body=buffer.getvalue())
+    query_cache.invalidate(table_name)
+    return key
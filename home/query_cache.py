@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import re
+import time
+
+CACHE_DIR = os.getenv('query_cache_dir', '/tmp/athena_cache')
+TTL = int(os.getenv('query_cache_ttl', 3600))
+
+# Tables written by this process. Athena's own result reuse cannot be invalidated, so it is skipped for them.
+DIRTY = set()
+
+_TABLE = re.compile(r'\b(?:from|join)\s+((?:"[^"]+"|\w+)(?:\.(?:"[^"]+"|\w+))?)', re.IGNORECASE)
+
+
+def normalize(query: str):
+    """
+    Collapses whitespace and the trailing semicolon, so formatting changes do not miss the cache.
+    Literals keep their case.
+    """
+    return ' '.join(query.split()).rstrip(';').strip()
+
+
+def is_select(query: str):
+    return normalize(query).split(' ', 1)[0].lower() in ('select', 'with')
+
+
+def reusable(query: str):
+    """
+    True when Athena may reuse a previous result of the query: a SELECT that reads no table written since
+    the process started.
+    """
+    return is_select(query) and not any(table in DIRTY for _, table in tables(query))
+
+
+def tables(query: str):
+    """
+    Returns the tables read by a query, as (database, table) pairs; database is None when not qualified.
+
+    Example:
+        tables('select * from "raw_financial-data_dev".earning_calendar a join profile b on ...')
+        # [('raw_financial-data_dev', 'earning_calendar'), (None, 'profile')]
+    """
+    found = list()
+    for name in _TABLE.findall(query):
+        parts = [part.strip('"').lower() for part in name.split('.')]
+        pair = (parts[0], parts[1]) if len(parts) == 2 else (None, parts[0])
+        if pair not in found:
+            found.append(pair)
+    return found
+
+
+def cache_key(query: str, versions: dict):
+    """
+    Key of a query: its normalized text plus the version of every table it reads.
+
+    Parameters:
+        query (str): SQL text.
+        versions (dict): Table name -> version (e.g. the Glue UpdateTime).
+
+    Returns:
+        str: Hex digest used as file name.
+    """
+    payload = json.dumps([normalize(query), sorted(versions.items())], default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def get(key: str, ttl: int = TTL):
+    """
+    Returns the cached rows of a key, or None when missing or older than `ttl` seconds.
+    """
+    path = os.path.join(CACHE_DIR, f'{key}.json')
+    try:
+        if time.time() - os.path.getmtime(path) > ttl:
+            os.remove(path)
+            return None
+        with open(path) as file:
+            return json.load(file)['rows']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def put(key: str, query: str, rows: list):
+    """
+    Stores the rows of a query, with the tables it reads so writes to them can invalidate the entry.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, f'{key}.json')
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as file:
+        json.dump(dict(tables=[table for _, table in tables(query)], rows=rows), file, default=str)
+    os.replace(tmp, path)
+
+
+def invalidate(table_name: str):
+    """
+    Drops every cached result that reads the table. Call it after writing to the table.
+
+    Parameters:
+        table_name (str): Table name, without database.
+
+    Returns:
+        int: Number of entries removed.
+    """
+    DIRTY.add(table_name.lower())
+    removed = 0
+    if not os.path.isdir(CACHE_DIR):
+        return removed
+    for name in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            with open(path) as file:
+                if table_name.lower() in json.load(file)['tables']:
+                    os.remove(path)
+                    removed += 1
+        except (OSError, ValueError, KeyError):
+            continue
+    return removed
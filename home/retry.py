@@ -0,0 +1,60 @@
+import random
+import threading
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter for transient API failures.
+    """
+    def __init__(self, attempts: int = 4, base: float = 0.5, cap: float = 20.0):
+        """
+        Initializes the RetryPolicy class.
+
+        Parameters:
+            attempts (int): Maximum number of attempts per request, including the first one.
+            base (float): Delay in seconds of the first retry before jitter.
+            cap (float): Maximum delay in seconds between two attempts.
+
+        Returns:
+            None
+        """
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+
+    def backoff(self, attempt: int):
+        """
+        Returns the seconds to wait after the failed `attempt` (0 based).
+
+        Example:
+            RetryPolicy(base=0.5).backoff(2)
+            # random value between 0 and 2.0
+        """
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+
+class RetryBudget:
+    """
+    Thread-safe number of retries allowed in a whole run, so a failing API cannot multiply the run time.
+    """
+    def __init__(self, total: int):
+        self.total = total
+        self.remaining = total
+        self._lock = threading.Lock()
+
+    def spend(self):
+        """
+        Takes one retry from the budget.
+
+        Returns:
+            bool: True if the retry is allowed, False when the budget is exhausted.
+        """
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+    def reset(self):
+        with self._lock:
+            self.remaining = self.total
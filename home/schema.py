@@ -0,0 +1,135 @@
+# Columns of the raw tables, as declared in repo/financial/models/raw_financial/souces.yml.
+# Keep both files in sync: the Parquet writer only keeps the columns listed here.
+# The data_process and year partition columns are part of the S3 key, not of the files.
+RAW_SCHEMAS = dict(
+    earning_calendar=[
+        ('date', 'string'),
+        ('symbol', 'string'),
+        ('eps', 'double'),
+        ('epsestimated', 'double'),
+        ('time', 'string'),
+        ('revenue', 'double'),
+        ('revenueestimated', 'double'),
+        ('fiscaldateending', 'string'),
+        ('updatedfromdate', 'string'),
+    ],
+    historical_price_full=[
+        ('search_date', 'string'),
+        ('symbol', 'string'),
+        ('historical_date', 'string'),
+        ('historical_open', 'double'),
+        ('historical_high', 'double'),
+        ('historical_low', 'double'),
+        ('historical_close', 'double'),
+        ('historical_adjclose', 'double'),
+        ('historical_volume', 'bigint'),
+        ('historical_unadjustedvolume', 'bigint'),
+        ('historical_change', 'double'),
+        ('historical_changepercent', 'double'),
+        ('historical_vwap', 'double'),
+        ('historical_label', 'string'),
+        ('historical_changeovertime', 'double'),
+    ],
+    profile=[
+        ('symbol', 'string'),
+        ('price', 'double'),
+        ('beta', 'double'),
+        ('volavg', 'bigint'),
+        ('mktcap', 'bigint'),
+        ('lastdiv', 'double'),
+        ('range', 'string'),
+        ('changes', 'double'),
+        ('companyname', 'string'),
+        ('currency', 'string'),
+        ('cik', 'string'),
+        ('isin', 'string'),
+        ('cusip', 'string'),
+        ('exchange', 'string'),
+        ('exchangeshortname', 'string'),
+        ('industry', 'string'),
+        ('website', 'string'),
+        ('description', 'string'),
+        ('ceo', 'string'),
+        ('sector', 'string'),
+        ('country', 'string'),
+        ('fulltimeemployees', 'string'),
+        ('phone', 'string'),
+        ('address', 'string'),
+        ('city', 'string'),
+        ('state', 'string'),
+        ('zip', 'string'),
+        ('dcfdiff', 'double'),
+        ('dcf', 'double'),
+        ('image', 'string'),
+        ('ipodate', 'string'),
+        ('defaultimage', 'boolean'),
+        ('isetf', 'boolean'),
+        ('isactivelytrading', 'boolean'),
+        ('isadr', 'boolean'),
+        ('isfund', 'boolean'),
+    ],
+)
+
+
+def _string(value):
+    return None if value is None else str(value)
+
+
+def _double(value):
+    try:
+        return None if value in (None, '') else float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _bigint(value):
+    try:
+        return None if value in (None, '') else int(float(value))
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def _boolean(value):
+    return None if value is None else bool(value)
+
+
+CASTS = dict(string=_string, double=_double, bigint=_bigint, boolean=_boolean)
+
+
+def columns(get_api: str, rows):
+    """
+    Turns the rows of an endpoint into one list of values per declared column.
+
+    API keys are matched case-insensitively (the raw tables use lower-case names), values are cast to the
+    declared type and columns missing from a row are filled with None.
+
+    Parameters:
+        get_api (str): API endpoint name.
+        rows (iterable or DataFrame): Dicts returned by the API, or a flattened DataFrame.
+
+    Returns:
+        dict: Column name -> values (list, or Series for a DataFrame), in the declared column order.
+    """
+    if hasattr(rows, 'columns'):
+        return _frame_columns(get_api, rows)
+    lowered = [{key.lower(): value for key, value in row.items()} for row in rows]
+    return {name: [CASTS[kind](row.get(name)) for row in lowered] for name, kind in RAW_SCHEMAS[get_api]}
+
+
+def _frame_columns(get_api: str, frame):
+    import pandas as pd
+
+    frame = frame.rename(columns=str.lower)
+    data = dict()
+    for name, kind in RAW_SCHEMAS[get_api]:
+        column = frame[name] if name in frame else pd.Series([None] * len(frame), dtype=object)
+        if kind == 'double':
+            column = pd.to_numeric(column, errors='coerce')
+        elif kind == 'bigint':
+            column = pd.to_numeric(column, errors='coerce').round().astype('Int64')
+        elif kind == 'boolean':
+            column = column.astype('boolean')
+        else:
+            column = column.astype(str).where(column.notna(), None)
+        data[name] = column
+    return data
@@ -0,0 +1,124 @@
+import json
+import multiprocessing
+import os
+import zlib
+import cleanup
+import financial
+import scheduler
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+SHARDS = int(os.getenv('shards', 1))
+# Keys and results of the shard invocations are passed through S3: a synchronous invoke carries 6 MB at most.
+PAYLOAD_PREFIX = 'shards/'
+
+
+def shard_of(symbol: str, shards: int):
+    """
+    Stable shard of a symbol: the same symbol always goes to the same worker, whatever the run.
+    """
+    return zlib.crc32(symbol.encode()) % shards
+
+
+def partition(keys: list, shards: int = SHARDS):
+    """
+    Splits the pending keys by symbol hash. All the keys of a symbol stay together, so the historical
+    windows of a symbol are still coalesced by a single worker.
+
+    Parameters:
+        keys (list): Pending keys, dicts with at least 'symbol'.
+        shards (int): Number of shards.
+
+    Returns:
+        list: Non-empty lists of keys, one per shard.
+
+    Example:
+        partition([{'symbol': 'AAPL'}, {'symbol': 'MSFT'}, {'symbol': 'AAPL'}], 2)
+    """
+    buckets = [list() for _ in range(shards)]
+    for key in keys:
+        buckets[shard_of(key['symbol'], shards)].append(key)
+    return [bucket for bucket in buckets if bucket]
+
+
+def dispatch(events: list, context, worker):
+    """
+    Runs one worker per shard in parallel and waits for all of them.
+
+    In Lambda every shard is a synchronous invocation of the same function, so the shards run in separate
+    containers; the keys and the result of each shard go through S3 objects referenced in the events,
+    whatever their size. Locally (FakeContext or no context) a process pool stands in for the invocations.
+
+    Parameters:
+        events (list): Worker events, one per shard.
+        context: Lambda context of the coordinator.
+        worker: Function run for each event in the local mode (e.g. main.run_shard).
+
+    Returns:
+        list: Result of each worker, in the order of the events; None for a worker that failed.
+    """
+    if context is None or isinstance(context, scheduler.FakeContext):
+        with ProcessPoolExecutor(max_workers=len(events), mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(worker, event) for event in events]
+            return [_result(future) for future in futures]
+    with ThreadPoolExecutor(max_workers=len(events)) as executor:
+        return list(executor.map(partial(_invoke, context.invoked_function_arn), events))
+
+
+def _result(future):
+    try:
+        return future.result()
+    except Exception as e:
+        print(f'Shard error: {e}')
+        return None
+
+
+def _invoke(function_arn: str, event: dict, bucket_name: str = os.getenv('bucket_raw')):
+    keys_key = f"{PAYLOAD_PREFIX}{event['run_id']}/{event['worker']}-{event['shard']}.keys.json"
+    try:
+        _put(keys_key, event['keys'], bucket_name)
+        response = financial.lambda_client.invoke(FunctionName=function_arn, InvocationType='RequestResponse',
+                                                  Payload=json.dumps(dict(event, keys=None, keys_key=keys_key)))
+        payload = json.loads(response['Payload'].read())
+        if 'FunctionError' in response:
+            print(f"Shard {event['shard']} error: {payload}")
+            return None
+        return _get(payload['result_key'], bucket_name)
+    except Exception as e:
+        print(f"Shard {event['shard']} error: {e}")
+        return None
+    finally:
+        try:
+            cleanup.delete_keys(financial.s3, bucket_name, [keys_key, _result_key(keys_key)])
+        except Exception as e:
+            print(f"Shard {event['shard']} payload not deleted: {e}")
+
+
+def event_keys(event: dict, bucket_name: str = os.getenv('bucket_raw')):
+    """
+    Keys of a shard event: read from S3 when the coordinator passed them by reference (see dispatch).
+    """
+    return _get(event['keys_key'], bucket_name) if event.get('keys_key') else event['keys']
+
+
+def reply(event: dict, result: dict, bucket_name: str = os.getenv('bucket_raw')):
+    """
+    Result of a shard for the coordinator: written to S3 and referenced when the keys came by reference.
+    """
+    if not event.get('keys_key'):
+        return result
+    key = _result_key(event['keys_key'])
+    _put(key, result, bucket_name)
+    return dict(result_key=key)
+
+
+def _result_key(keys_key: str):
+    return keys_key.replace('.keys.json', '.result.json')
+
+
+def _put(key: str, value, bucket_name: str):
+    financial.s3.put_object(Bucket=bucket_name, Key=key, Body=json.dumps(value).encode())
+
+
+def _get(key: str, bucket_name: str):
+    return json.loads(financial.s3.get_object(Bucket=bucket_name, Key=key)['Body'].read())
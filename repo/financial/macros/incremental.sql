@@ -0,0 +1,53 @@
+{#- Highest value of a column already loaded in the model; the next incremental run starts from it. -#}
+{% macro high_water_mark(column, default='1900-01-01') -%}
+    {%- if execute and is_incremental() -%}
+        {%- set result = run_query('select cast(max(' ~ column ~ ') as varchar) from ' ~ this) -%}
+        {%- set value = result.columns[0].values()[0] -%}
+        {%- if value is not none -%}
+            {{ return(value) }}
+        {%- endif -%}
+    {%- endif -%}
+    {{ return(default) }}
+{%- endmacro %}
+
+
+{#- Distinct values of an expression over the source rows landed since the high-water mark.
+    Rendered as literals in the model, so Athena prunes the target partitions statically. -#}
+{% macro delta_partitions(relation, expression, column, hwm) -%}
+    {%- if execute -%}
+        {%- set query -%}
+            select distinct {{ expression }} from {{ relation }} where {{ column }} >= '{{ hwm }}'
+        {%- endset -%}
+        {{ return(run_query(query).columns[0].values() | reject('none') | list) }}
+    {%- endif -%}
+    {{ return([]) }}
+{%- endmacro %}
+
+
+{#- Latest row of each unique key among the source rows landed since the high-water mark.
+    Columns are listed from the catalog so the ranking column does not leak into the model. -#}
+{% macro latest_rows(relation, unique_key, hwm) -%}
+    {%- set columns = adapter.get_columns_in_relation(relation) | map(attribute='name') | list -%}
+    select {% for column in columns %}"{{ column }}"{{ ", " if not loop.last }}{% endfor %}
+    from (
+        select *, row_number() over (partition by {{ unique_key | join(', ') }} order by data_process desc) as row_rank
+        from {{ relation }}
+        where data_process >= '{{ hwm }}'
+    )
+    where row_rank = 1
+{%- endmacro %}
+
+
+{#- The ref models are Hive tables by default; --vars "{ref_table_type: iceberg}" builds them as Iceberg. -#}
+{% macro is_iceberg() -%}
+    {{ return(var('ref_table_type', 'hive') == 'iceberg') }}
+{%- endmacro %}
+
+
+{#- Iceberg properties of the ref models: snapshots older than 3 days are expired by VACUUM. -#}
+{% macro ref_table_properties() -%}
+    {%- if is_iceberg() -%}
+        {{ return({'vacuum_max_snapshot_age_seconds': '259200', 'vacuum_min_snapshots_to_keep': '1'}) }}
+    {%- endif -%}
+    {{ return(none) }}
+{%- endmacro %}
@@ -0,0 +1,17 @@
+{#- Compacts the small files of the Iceberg ref tables and expires their old snapshots.
+    Run after the models: dbt run-operation maintain_ref_tables. Nothing to do for Hive tables. -#}
+{% macro maintain_ref_tables() %}
+    {%- if not is_iceberg() -%}
+        {% do log('ref tables are Hive, no maintenance needed', info=True) %}
+        {{ return(none) }}
+    {%- endif -%}
+    {%- for node in graph.nodes.values() if node.resource_type == 'model' and 'ref_financial' in node.fqn -%}
+        {%- set relation = adapter.get_relation(database=node.database, schema=node.schema, identifier=node.alias) -%}
+        {%- if relation is not none -%}
+            {%- set name = relation.include(database=false) -%}
+            {% do log('OPTIMIZE and VACUUM ' ~ name, info=True) %}
+            {% do run_query('OPTIMIZE ' ~ name ~ ' REWRITE DATA USING BIN_PACK') %}
+            {% do run_query('VACUUM ' ~ name) %}
+        {%- endif -%}
+    {%- endfor -%}
+{% endmacro %}
@@ -1,8 +1,24 @@
 {{ config(
     materialized='incremental',
+    table_type=var('ref_table_type', 'hive'),
+    incremental_strategy='merge' if is_iceberg() else 'insert_overwrite',
+    unique_key=['symbol', 'date'],
     partitioned_by=['year_date'],
-    target_schema='ref_financial',
-    target_table='historical_price_full',
-    strategy='merge'
+    table_properties=ref_table_properties()
 ) }}
-select *, EXTRACT(YEAR FROM CAST(date AS DATE)) AS year_date from {{ source('raw_financial', 'earning_calendar') }}
+{#- Reads only the raw partitions landed since the last run; the latest data_process wins for a key.
+    Iceberg merges the new rows by key. Hive rewrites the year_date partitions they touch with their
+    current rows plus the new ones. -#}
+{%- set hwm = high_water_mark('data_process') %}
+with delta as (
+    select d.*, EXTRACT(YEAR FROM CAST(d.date AS DATE)) AS year_date
+    from ({{ latest_rows(source('raw_financial', 'earning_calendar'), ['symbol', 'date'], hwm) }}) d
+)
+select * from delta
+{%- if is_incremental() and not is_iceberg() %}
+{%- set years = delta_partitions(source('raw_financial', 'earning_calendar'), 'EXTRACT(YEAR FROM CAST(date AS DATE))', 'data_process', hwm) %}
+union all
+select t.* from {{ this }} t
+where {% if years %}t.year_date in ({{ years | join(', ') }}){% else %}false{% endif %}
+and not exists (select 1 from delta d where d.symbol = t.symbol and d.date = t.date)
+{%- endif %}
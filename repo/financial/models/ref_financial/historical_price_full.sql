@@ -1,8 +1,27 @@
 {{ config(
     materialized='incremental',
+    table_type=var('ref_table_type', 'hive'),
+    incremental_strategy='merge' if is_iceberg() else 'insert_overwrite',
+    unique_key=['symbol', 'search_date', 'historical_date'],
     partitioned_by=['year_search_date'],
-    target_schema='ref_financial',
-    target_table='historical_price_full',
-    strategy='merge'
+    table_properties=ref_table_properties()
 ) }}
-select *, EXTRACT(YEAR FROM CAST(search_date AS DATE)) AS year_search_date from {{ source('raw_financial', 'historical_price_full') }}
\ No newline at end of file
+{#- Reads only the raw partitions landed since the last run; the latest data_process wins for a key.
+    Iceberg merges the new rows by key. Hive rewrites the year_search_date partitions they touch with
+    their current rows plus the new ones. -#}
+{%- set hwm = high_water_mark('data_process') %}
+with delta as (
+    select d.*, EXTRACT(YEAR FROM CAST(d.search_date AS DATE)) AS year_search_date
+    from ({{ latest_rows(source('raw_financial', 'historical_price_full'), ['symbol', 'search_date', 'historical_date'], hwm) }}) d
+)
+select * from delta
+{%- if is_incremental() and not is_iceberg() %}
+{%- set years = delta_partitions(source('raw_financial', 'historical_price_full'), 'EXTRACT(YEAR FROM CAST(search_date AS DATE))', 'data_process', hwm) %}
+union all
+select t.* from {{ this }} t
+where {% if years %}t.year_search_date in ({{ years | join(', ') }}){% else %}false{% endif %}
+and not exists (
+    select 1 from delta d
+    where d.symbol = t.symbol and d.search_date = t.search_date and d.historical_date = t.historical_date
+)
+{%- endif %}
@@ -1,11 +1,15 @@
 {{ config(
     materialized='incremental',
+    table_type=var('ref_table_type', 'hive'),
+    incremental_strategy='merge' if is_iceberg() else 'append',
     unique_key='symbol',
-    target_schema='ref_financial',
-    target_table='profile',
-    strategy='merge'
+    table_properties=ref_table_properties()
 ) }}
-select * from {{ source('raw_financial', 'profile') }}
-
-
-
+{#- Profiles are fetched once per symbol: only the symbols landed since the last run are loaded.
+    Iceberg merges them by symbol; Hive appends the symbols not loaded yet. -#}
+{%- set hwm = high_water_mark('data_process') %}
+select s.*
+from ({{ latest_rows(source('raw_financial', 'profile'), ['symbol'], hwm) }}) s
+{%- if is_incremental() and not is_iceberg() %}
+where not exists (select 1 from {{ this }} t where t.symbol = s.symbol)
+{%- endif %}
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The Lambda modules are flat files under aws/lambda (the function's CodeUri), imported by name.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'aws', 'lambda'))
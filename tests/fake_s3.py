@@ -0,0 +1,75 @@
+import io
+import itertools
+
+
+class FakeS3:
+    """
+    In-memory stand-in for the boto3 S3 client calls used by s3_writer, cleanup and manifest.
+
+    Completed objects are kept in `objects` (key -> bytes), multipart uploads in progress in `uploads`.
+    `fail_on` names a method that raises, to exercise the error paths.
+    """
+    def __init__(self, fail_on: str = None):
+        self.objects = dict()
+        self.uploads = dict()
+        self.calls = list()
+        self.fail_on = fail_on
+        self._ids = itertools.count(1)
+
+    def _call(self, name: str):
+        self.calls.append(name)
+        if name == self.fail_on:
+            raise RuntimeError(f'{name} failed')
+
+    def put_object(self, Bucket, Key, Body):
+        self._call('put_object')
+        self.objects[Key] = bytes(Body)
+
+    def get_object(self, Bucket, Key):
+        self._call('get_object')
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def copy_object(self, Bucket, CopySource, Key):
+        self._call('copy_object')
+        self.objects[Key] = self.objects[CopySource['Key']]
+
+    def delete_objects(self, Bucket, Delete):
+        self._call('delete_objects')
+        for obj in Delete['Objects']:
+            self.objects.pop(obj['Key'], None)
+        return dict()
+
+    def get_paginator(self, name):
+        assert name == 'list_objects_v2'
+        return self
+
+    def paginate(self, Bucket, Prefix=''):
+        self._call('list_objects_v2')
+        keys = sorted(key for key in self.objects if key.startswith(Prefix))
+        for index in range(0, len(keys), 1000):
+            yield {'Contents': [{'Key': key} for key in keys[index:index + 1000]]}
+
+    def create_multipart_upload(self, Bucket, Key):
+        self._call('create_multipart_upload')
+        upload_id = str(next(self._ids))
+        self.uploads[upload_id] = dict(key=Key, parts=dict())
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self._call('upload_part')
+        self.uploads[UploadId]['parts'][PartNumber] = bytes(Body)
+        return {'ETag': f'"{UploadId}-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self._call('complete_multipart_upload')
+        upload = self.uploads.pop(UploadId)
+        numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+        assert numbers == sorted(upload['parts']), 'parts must be listed in order'
+        self.objects[Key] = b''.join(upload['parts'][number] for number in numbers)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self._call('abort_multipart_upload')
+        self.uploads.pop(UploadId)
+
+    def part_sizes(self, upload_id: str):
+        return [len(body) for _, body in sorted(self.uploads[upload_id]['parts'].items())]
@@ -0,0 +1,14 @@
+import json
+
+import financial
+
+
+def test_ndjson_keeps_integer_volumes_when_a_bar_lacks_them():
+    frame = financial.flatten_historical([dict(symbol='AAPL', search_date='2024-01-02', historical=[
+        dict(date='2024-01-02', close=185.5, volume=10, unadjustedVolume=12),
+        dict(date='2024-01-03', close=184.0),
+    ])])
+    lines = financial.to_ndjson(frame).decode().splitlines()
+    assert '"historical_volume":10,' in lines[0]
+    assert [json.loads(line)['historical_unadjustedVolume'] for line in lines] == [12, None]
+    assert [json.loads(line)['historical_close'] for line in lines] == [185.5, 184.0]
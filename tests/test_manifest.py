@@ -0,0 +1,119 @@
+import io
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import financial
+import manifest
+from fake_s3 import FakeS3
+
+BUCKET = 'raw'
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = FakeS3()
+    monkeypatch.setattr(financial, 's3', client)
+    return client
+
+
+def unload(client, state: str, rows: list = None):
+    """
+    Stand-in for financial.execute_query: an UNLOAD that writes `rows` as Parquet under its TO prefix.
+    """
+    queries = list()
+
+    def execute_query(query, database=None):
+        queries.append(query)
+        prefix = query.split("TO 's3://", 1)[1].split("'", 1)[0].split('/', 1)[1]
+        if rows is not None:
+            buffer = io.BytesIO()
+            names = ['symbol', 'date'][:len(rows[0])] if rows else ['symbol']
+            pq.write_table(pa.table({name: pa.array([row[index] for row in rows], type=pa.string())
+                                     for index, name in enumerate(names)}), buffer)
+            client.objects[f'{prefix}20240102_000000_00001_abcde_1'] = buffer.getvalue()
+        return {'QueryExecutionId': 'id', 'Status': {'State': state}}
+    return execute_query, queries
+
+
+def test_seed_copies_the_unloaded_files_as_base_files(client, monkeypatch):
+    execute_query, queries = unload(client, 'SUCCEEDED', [('AAPL',), ('MSFT',)])
+    monkeypatch.setattr(financial, 'execute_query', execute_query)
+    manifest.seed('process_profile', 'SELECT DISTINCT symbol FROM ref.profile', bucket_name=BUCKET)
+
+    assert queries[0].strip().startswith('UNLOAD')
+    assert 'get_object' not in client.calls
+    assert not [key for key in client.objects if key.startswith(manifest.SEED_PREFIX)]
+    assert [key for key in client.objects if manifest._is_base(key)]
+    assert manifest.load_keys('process_profile', [('AAPL',), ('GOOG',)], BUCKET) == {('AAPL',)}
+
+    # Seeded once: a second call does not query again.
+    manifest.seed('process_profile', 'SELECT DISTINCT symbol FROM ref.profile', bucket_name=BUCKET)
+    assert len(queries) == 1
+
+
+def test_seed_retries_when_the_query_fails(client, monkeypatch):
+    execute_query, queries = unload(client, 'FAILED', [('AAPL',)])
+    monkeypatch.setattr(financial, 'execute_query', execute_query)
+    manifest.seed('process_profile', 'SELECT DISTINCT symbol FROM ref.profile', bucket_name=BUCKET)
+    assert client.objects == {}
+
+    manifest.seed('process_profile', 'SELECT DISTINCT symbol FROM ref.profile', bucket_name=BUCKET)
+    assert len(queries) == 2
+
+
+def test_seed_of_an_empty_ref_table_writes_an_empty_base_file(client, monkeypatch):
+    execute_query, queries = unload(client, 'SUCCEEDED')
+    monkeypatch.setattr(financial, 'execute_query', execute_query)
+    manifest.seed('process_profile', 'SELECT DISTINCT symbol FROM ref.profile', bucket_name=BUCKET)
+    manifest.seed('process_profile', 'SELECT DISTINCT symbol FROM ref.profile', bucket_name=BUCKET)
+    assert len(queries) == 1
+    assert manifest.load_keys('process_profile', [('AAPL',)], BUCKET) == set()
+
+
+class TextTable:
+    """
+    Glue client whose progress table is still a text table, and Athena DDL recorder.
+    """
+    class exceptions:
+        EntityNotFoundException = KeyError
+
+    def __init__(self):
+        self.statements = list()
+
+    def get_table(self, DatabaseName, Name):
+        return {'Table': {'StorageDescriptor': {'InputFormat': 'org.apache.hadoop.mapred.TextInputFormat'}}}
+
+    def create_table(self, query, database=None):
+        self.statements.append(' '.join(query.split()))
+        return []
+
+
+@pytest.fixture
+def text_table(client, monkeypatch):
+    glue = TextTable()
+    monkeypatch.setattr(financial, 'glue_client', glue)
+    monkeypatch.setattr(financial, 'create_table', glue.create_table)
+    for index in range(3):
+        client.objects[f'process_historical_price_full/part-{index}'] = b'AAPL\x012024-01-02\n'
+    return glue
+
+
+def test_migration_keeps_the_text_files_when_the_query_fails(client, text_table, monkeypatch):
+    execute_query, _ = unload(client, 'FAILED', [('AAPL', '2024-01-02')])
+    monkeypatch.setattr(financial, 'execute_query', execute_query)
+    manifest.ensure_table('process_historical_price_full', bucket_name=BUCKET)
+    assert sorted(client.objects) == [f'process_historical_price_full/part-{index}' for index in range(3)]
+    assert text_table.statements == []
+
+
+def test_migration_replaces_the_text_files_with_manifests(client, text_table, monkeypatch):
+    execute_query, _ = unload(client, 'SUCCEEDED', [('AAPL', '2024-01-02'), ('MSFT', '2024-01-03')])
+    monkeypatch.setattr(financial, 'execute_query', execute_query)
+    manifest.ensure_table('process_historical_price_full', bucket_name=BUCKET)
+    assert all(key.endswith('.parquet') and not manifest._is_base(key) for key in client.objects)
+    assert text_table.statements[0] == 'DROP TABLE IF EXISTS process_historical_price_full'
+    assert 'STORED AS PARQUET' in text_table.statements[1]
+    assert manifest.load_keys('process_historical_price_full', [('AAPL', '2024-01-02'), ('AAPL', '2024-01-03')],
+                              BUCKET) == {('AAPL', '2024-01-02')}
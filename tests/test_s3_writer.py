@@ -0,0 +1,125 @@
+import gzip
+import io
+import json
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import s3_writer
+from fake_s3 import FakeS3
+
+
+def ndjson(rows):
+    return b''.join(json.dumps(row).encode() + b'\n' for row in rows)
+
+
+def test_small_object_is_a_single_put():
+    client = FakeS3()
+    writer = s3_writer.MultipartWriter(client, 'bucket', 'key.json', part_size=100)
+    writer.write(b'x' * 40)
+    writer.close()
+    assert client.calls == ['put_object']
+    assert client.objects['key.json'] == b'x' * 40
+
+
+def test_empty_object_is_not_uploaded():
+    client = FakeS3()
+    s3_writer.MultipartWriter(client, 'bucket', 'key.json', part_size=100).close()
+    assert client.calls == []
+
+
+def test_large_object_is_uploaded_in_parts():
+    client = FakeS3()
+    writer = s3_writer.MultipartWriter(client, 'bucket', 'key.json', part_size=100)
+    data = bytes(range(256)) * 2
+    for start in range(0, len(data), 30):
+        writer.write(data[start:start + 30])
+    assert writer.tell() == len(data)
+    writer.close()
+    assert client.calls[0] == 'create_multipart_upload'
+    assert client.calls.count('upload_part') == 5
+    assert client.calls[-1] == 'complete_multipart_upload'
+    assert client.objects['key.json'] == data
+
+
+def test_part_boundaries():
+    client = FakeS3()
+    writer = s3_writer.MultipartWriter(client, 'bucket', 'key.json', part_size=100)
+    for _ in range(7):
+        writer.write(b'y' * 45)
+    # Every part but the last holds at least part_size bytes; nothing below the threshold is sent early.
+    assert client.part_sizes(writer._upload_id) == [135, 135]
+    assert len(writer._buffer) == 45
+    writer.close()
+    assert client.objects['key.json'] == b'y' * 315
+
+
+def test_failed_upload_is_aborted():
+    client = FakeS3(fail_on='complete_multipart_upload')
+    writer = s3_writer.MultipartWriter(client, 'bucket', 'key.json', part_size=100)
+    writer.write(b'z' * 250)
+    with pytest.raises(RuntimeError):
+        writer.close()
+    assert client.calls[-1] == 'abort_multipart_upload'
+    assert client.uploads == {}
+    assert client.objects == {}
+    assert writer.closed
+
+
+def test_gzip_round_trip():
+    client = FakeS3()
+    writer = s3_writer.RollingWriter(client, 'bucket', 'json', compression='gzip', part_size=64)
+    rows = [{'symbol': f'S{index}', 'date': '2024-01-02', 'eps': index / 3} for index in range(200)]
+    writer.write('earning_calendar/data_process=2024-01-02/year=2024', ndjson(rows[:120]))
+    writer.write('earning_calendar/data_process=2024-01-02/year=2024', ndjson(rows[120:]))
+    writer.close()
+    (key,) = writer.keys
+    assert key.endswith('.json.gz')
+    lines = gzip.decompress(client.objects[key]).splitlines()
+    assert [json.loads(line) for line in lines] == rows
+
+
+def test_one_object_per_prefix_and_roll_over():
+    client = FakeS3()
+    writer = s3_writer.RollingWriter(client, 'bucket', 'json', compression='none', object_size=100)
+    writer.write('profile/data_process=2024-01-02', b'a' * 60)
+    writer.write('profile/data_process=2024-01-03', b'b' * 10)
+    writer.write('profile/data_process=2024-01-02', b'a' * 60)
+    writer.write('profile/data_process=2024-01-02', b'c' * 10)
+    writer.close()
+    assert len(writer.keys) == 3
+    assert [client.objects[key] for key in writer.keys] == [b'a' * 120, b'b' * 10, b'c' * 10]
+
+
+def test_close_keeps_the_writer_usable():
+    client = FakeS3()
+    writer = s3_writer.RollingWriter(client, 'bucket', 'json', compression='none')
+    writer.write('profile/data_process=2024-01-02', b'first\n')
+    writer.close()
+    writer.write('profile/data_process=2024-01-02', b'second\n')
+    writer.close()
+    assert [client.objects[key] for key in writer.keys] == [b'first\n', b'second\n']
+
+
+def test_parquet_parts_are_appended_to_one_file():
+    client = FakeS3()
+    writer = s3_writer.RollingWriter(client, 'bucket', 'parquet', part_size=64)
+    for index in range(3):
+        table = pa.table({'symbol': [f'S{index}'], 'eps': [float(index)]})
+        writer.write('earning_calendar/data_process=2024-01-02/year=2024',
+                     s3_writer.ParquetPart(table, 'snappy', 1000))
+    writer.close()
+    (key,) = writer.keys
+    assert key.endswith('.parquet')
+    parquet = pq.ParquetFile(io.BytesIO(client.objects[key]))
+    assert parquet.metadata.num_row_groups == 3
+    assert parquet.read().to_pydict() == {'symbol': ['S0', 'S1', 'S2'], 'eps': [0.0, 1.0, 2.0]}
+
+
+def test_local_root(tmp_path):
+    writer = s3_writer.RollingWriter(None, None, 'json', compression='gzip', root=str(tmp_path))
+    writer.write('profile/data_process=2024-01-02', b'{"symbol": "AAPL"}\n')
+    writer.close()
+    (key,) = writer.keys
+    assert gzip.decompress((tmp_path / key).read_bytes()) == b'{"symbol": "AAPL"}\n'
@@ -0,0 +1,57 @@
+import io
+import json
+
+import pytest
+
+import financial
+import main
+import sharding
+from fake_s3 import FakeS3
+
+
+class FakeContext:
+    invoked_function_arn = 'arn:aws:lambda:us-east-1:123456789012:function:financial'
+
+
+class FakeLambda:
+    """
+    Runs the invoked shard in-process, recording the size of every request and response payload.
+    """
+    def __init__(self):
+        self.sizes = list()
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self.sizes.append(len(Payload))
+        result = json.dumps(main.lambda_handler(json.loads(Payload), None))
+        self.sizes.append(len(result))
+        return {'Payload': io.BytesIO(result.encode())}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = FakeS3()
+    monkeypatch.setattr(financial, 's3', client)
+    monkeypatch.setattr(financial, 'lambda_client', FakeLambda())
+    monkeypatch.setitem(main.FETCHERS, 'historical_price_full',
+                        lambda keys: [[key['symbol'], key['date']] for key in keys])
+    return client
+
+
+def test_shard_keys_and_results_go_through_s3(client):
+    keys = [{'symbol': f'S{index:06d}', 'date': '2024-01-02'} for index in range(50000)]
+    events = [dict(worker='historical_price_full', shard=index, shards=2, keys=part, expires_at=None, run_id='20240102')
+              for index, part in enumerate(sharding.partition(keys, 2))]
+    results = sharding.dispatch(events, FakeContext(), main.run_shard)
+
+    done = sorted(key for result in results for key in result['done'])
+    assert done == sorted([key['symbol'], key['date']] for key in keys)
+    assert max(financial.lambda_client.sizes) < 1000
+    assert client.objects == {}
+
+
+def test_a_failed_shard_returns_none_and_leaves_no_payload(client, monkeypatch):
+    monkeypatch.setitem(main.FETCHERS, 'historical_price_full', lambda keys: 1 / 0)
+    events = [dict(worker='historical_price_full', shard=0, shards=1, keys=[{'symbol': 'AAPL', 'date': '2024-01-02'}],
+                   expires_at=None, run_id='20240102')]
+    assert sharding.dispatch(events, FakeContext(), main.run_shard) == [None]
+    assert client.objects == {}
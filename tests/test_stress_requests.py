@@ -0,0 +1,142 @@
+"""
+Concurrency stress test of the request path: every key must be requested exactly once and its response
+saved under the right key, whatever the number of threads.
+
+The HTTP session is replaced by a stub that answers from the URL and parameters after a random delay,
+so no API call is made and nothing is written to S3. The requests go through main.request_and_save and
+engine.run exactly as in a run, sharing one Financial client across all the threads.
+"""
+import random
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+from functools import partial
+
+import pytest
+
+import engine
+import financial
+import main
+import planner
+from rate_limit import TokenBucket
+
+KEYS = 300
+MAX_DELAY = 0.002
+
+
+class StubResponse:
+    status_code = 200
+    headers = dict()
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+class StubSession:
+    """
+    Answers every endpoint from the request itself and counts the requests.
+    """
+    def __init__(self, max_delay: float = MAX_DELAY):
+        self.max_delay = max_delay
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def get(self, url, params=None, timeout=None):
+        time.sleep(random.uniform(0, self.max_delay))
+        path = url.rsplit('/v3/', 1)[1]
+        key = (path, params.get('from'), params.get('to'))
+        with self._lock:
+            self.calls[key] += 1
+        if path.startswith('profile/'):
+            return StubResponse([{'symbol': symbol} for symbol in path.split('/', 1)[1].split(',')])
+        days = [str(date.fromisoformat(params['from']) + timedelta(days=offset))
+                for offset in range((date.fromisoformat(params['to']) - date.fromisoformat(params['from'])).days + 1)]
+        if path.startswith('historical-price-full/'):
+            return StubResponse({'symbol': path.split('/', 1)[1], 'historical': [{'date': day} for day in days]})
+        return StubResponse([{'symbol': 'AAPL', 'date': day} for day in days])
+
+
+class RecordingSink:
+    def __init__(self):
+        self.items = list()
+        self._lock = threading.Lock()
+
+    def put(self, item, size: int = 1):
+        with self._lock:
+            self.items.append(item)
+
+
+@pytest.fixture
+def session(monkeypatch):
+    session = StubSession()
+    monkeypatch.setattr(financial, '_SESSION', session)
+    monkeypatch.setattr(financial, 'LIMITER', TokenBucket(rate=1e9, burst=10 ** 9))
+    # Small profile batches, so profile also runs many concurrent requests.
+    monkeypatch.setattr(main, 'PROFILE_BATCH_SIZE', 7)
+    return session
+
+
+def check(session: StubSession, expected: set, results: list):
+    """
+    Asserts that the requests made are exactly the expected ones, each made once, and all succeeded.
+    """
+    duplicated = {key: count for key, count in session.calls.items() if count > 1}
+    assert not duplicated, f'requested more than once: {list(duplicated.items())[:5]}'
+    assert set(session.calls) == expected, \
+        f'{len(expected - set(session.calls))} missing, {len(set(session.calls) - expected)} unexpected'
+    assert all(results), f'{results.count(None)} requests failed'
+
+
+@pytest.mark.parametrize('concurrency', [8, 64])
+def test_profile_symbols_are_saved_once(session, concurrency):
+    fn = financial.Financial(api_key='stress')
+    symbols = [f'S{index:05d}' for index in range(KEYS)]
+    sink = RecordingSink()
+    batches = [symbols[index:index + main.PROFILE_BATCH_SIZE] for index in range(0, KEYS, main.PROFILE_BATCH_SIZE)]
+    tasks = (partial(main.request_and_save, fn, financial.RequestSpec('profile', symbol=','.join(batch)), sink)
+             for batch in batches)
+    results = engine.run(tasks, concurrency)
+    check(session, {(f"profile/{','.join(batch)}", None, None) for batch in batches}, results)
+    assert sorted(item['symbol'] for item in sink.items) == symbols
+
+
+@pytest.mark.parametrize('concurrency', [8, 64])
+def test_historical_search_dates_are_saved_once_under_their_symbol(session, concurrency):
+    fn = financial.Financial(api_key='stress')
+    pending = [(f'S{index:05d}', str(date(2023, 1, 1) + timedelta(days=random.randrange(365))))
+               for index in range(KEYS)]
+    windows = planner.coalesce_windows(pending)
+    sink = RecordingSink()
+    tasks = (partial(main.request_and_save, fn,
+                     financial.RequestSpec('historical_price_full', symbol=window['symbol'],
+                                           start_date=window['from'], end_date=window['to']),
+                     sink, window)
+             for window in windows)
+    results = engine.run(tasks, concurrency)
+    check(session,
+          {(f"historical-price-full/{window['symbol']}", str(window['from']), str(window['to'])) for window in windows},
+          results)
+    assert sorted((item['symbol'], item['search_date']) for item in sink.items) == sorted(pending)
+
+
+@pytest.mark.parametrize('concurrency', [8, 64])
+def test_earning_calendar_days_are_saved_once(session, concurrency):
+    fn = financial.Financial(api_key='stress')
+    start_date = date(2000, 1, 1)
+    windows = [(start_date + timedelta(days=offset * 3), start_date + timedelta(days=offset * 3 + 2))
+               for offset in range(KEYS // 3)]
+    sink = RecordingSink()
+    tasks = (partial(main.request_and_save, fn,
+                     financial.RequestSpec('earning_calendar', start_date=start, end_date=end), sink)
+             for start, end in windows)
+    results = engine.run(tasks, concurrency)
+    check(session, {('earning_calendar', str(start), str(end)) for start, end in windows}, results)
+    saved = Counter(item['date'] for item in sink.items)
+    assert len(saved) == len(windows) * 3 and set(saved.values()) == {1}